@@ -0,0 +1,112 @@
+# src/async_api.py
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+from src.groq_api import (
+    DEFAULT_TIMEOUT,
+    _RETRY_STATUSES,
+    _groq_request,
+    _json_schema_unsupported,
+    _parse_groq_response,
+    _retry_sleep,
+    _strict_output,
+)
+from src.run_text2sql import LOGGER, _lmstudio_payload, _parse_lmstudio_response
+
+
+# =========================
+# httpx.AsyncClient 版の LLM 呼び出し
+# （run_text2sql.call_lmstudio_text2sql / groq_api.call_groq_text2sql と同じ入出力）
+# 1つの AsyncClient(http2=True) を共有すれば、複数ケースを同じ接続上で多重化できる。
+# =========================
+def make_async_client(timeout: int = DEFAULT_TIMEOUT) -> httpx.AsyncClient:
+    return httpx.AsyncClient(http2=True, timeout=timeout)
+
+
+async def call_lmstudio_async(
+    client: httpx.AsyncClient,
+    *,
+    api_url: str,
+    model: str,
+    system: str,
+    user: str,
+    temperature: float = 0.1,
+    top_p: float = 0.95,
+    timeout: int = 120,
+) -> Dict[str, Any]:
+    """
+    LM Studio の /v1/chat/completions を非同期で叩いて structured JSON を受け取る。
+    """
+    payload = _lmstudio_payload(model=model, system=system, user=user, temperature=temperature, top_p=top_p)
+
+    LOGGER.info("POST %s model=%s", api_url, model)
+    res = await client.post(api_url, json=payload, timeout=timeout)
+    if res.status_code != 200:
+        LOGGER.warning("non-200: %s", res.text[:500])
+        raise RuntimeError(f"LM Studio returned {res.status_code}")
+
+    return _parse_lmstudio_response(res.json())
+
+
+async def _apost_with_retry(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    *,
+    timeout: int,
+    max_retries: int = 3,
+) -> httpx.Response:
+    """
+    429/503/504 など一時エラーは軽くリトライ（groq_api._post_with_retry の非同期版）。
+    """
+    last_exc: Optional[Exception] = None
+    for i in range(max_retries + 1):
+        try:
+            r = await client.post(url, headers=headers, json=payload, timeout=timeout)
+            if r.status_code in _RETRY_STATUSES:
+                await asyncio.sleep(_retry_sleep(i, failed=False))
+                continue
+            return r
+        except Exception as e:
+            last_exc = e
+            await asyncio.sleep(_retry_sleep(i, failed=True))
+            continue
+    if last_exc:
+        raise last_exc
+    raise RuntimeError("request failed without exception")
+
+
+async def call_groq_async(
+    client: httpx.AsyncClient,
+    *,
+    system: str,
+    user: str,
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    timeout: int = DEFAULT_TIMEOUT,
+    temperature: float = 0.1,
+    top_p: float = 0.95,
+) -> Dict[str, Any]:
+    """
+    Groq OpenAI互換 /chat/completions を非同期で叩いて
+    {"sql": "...", "assumptions": [...]} を返す（json_schema → json_object のフォールバックも同じ）。
+    """
+    url, headers, payload_schema, payload_object = _groq_request(
+        system=system, user=user, model=model, api_key=api_key, temperature=temperature, top_p=top_p
+    )
+
+    payload = payload_schema
+    r = await _apost_with_retry(client, url, headers, payload, timeout=timeout)
+
+    # 400で json_schema 非対応なら json_object にフォールバック
+    if _json_schema_unsupported(r.status_code, r.text):
+        payload = payload_object
+        r = await _apost_with_retry(client, url, headers, payload, timeout=timeout)
+
+    data = r.json() if r.status_code == 200 else None
+    return _parse_groq_response(r.status_code, r.text, data, allow_salvage=not _strict_output(payload))
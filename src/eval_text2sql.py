@@ -1,28 +1,34 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
+import re
 from dataclasses import dataclass
 from decimal import Decimal, InvalidOperation
+from operator import itemgetter
 from typing import Any, Dict, List, Tuple
 
+import httpx
+import numpy as np
 import psycopg
+from psycopg_pool import ConnectionPool
 
+from src.async_api import call_groq_async, call_lmstudio_async, make_async_client
 from src.run_text2sql import (
-    call_lmstudio_text2sql,
     fetch_schema_summary,
     format_table,
     guard_sql,
     run_query,
 )
-from src.text2sql_prompt import build_text2sql_messages
+from src.text2sql_prompt import PromptBundle, build_system, build_user
 from src.gpt_oss_local_api import get_config, _ensure_logger
 
-from src.groq_api import call_groq_text2sql
-
 from dotenv import load_dotenv
 load_dotenv()
 
+LOGGER = _ensure_logger()
+
 @dataclass
 class CaseResult:
     id: int
@@ -32,6 +38,19 @@ class CaseResult:
     error: str | None = None
 
 
+# 数値っぽい文字列だけ許可（例: -12, 3.14, 1e-5）
+_NUM_RE = re.compile(r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?")
+
+_QUANT_CACHE: Dict[int, Decimal] = {}
+
+
+def _quantizer(float_round: int) -> Decimal:
+    q = _QUANT_CACHE.get(float_round)
+    if q is None:
+        q = _QUANT_CACHE[float_round] = Decimal("1." + ("0" * float_round))
+    return q
+
+
 def _to_decimal(x: Any) -> Decimal | None:
     if x is None:
         return None
@@ -49,9 +68,7 @@ def _to_decimal(x: Any) -> Decimal | None:
         s = x.strip()
         if not s:
             return None
-        # 数値っぽい文字列だけ許可（例: -12, 3.14, 1e-5）
-        import re
-        if not re.fullmatch(r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?", s):
+        if not _NUM_RE.fullmatch(s):
             return None
         try:
             return Decimal(s)
@@ -60,6 +77,54 @@ def _to_decimal(x: Any) -> Decimal | None:
     return None
 
 
+# ---- 型ごとの正規化（q は丸め用の Decimal("1.000000") など）----
+def _as_none(x: Any, q: Decimal) -> Any:
+    return None
+
+
+def _as_str(x: str, q: Decimal) -> Any:
+    s = x.strip()
+    return None if s == "" else s
+
+
+def _as_int(x: int, q: Decimal) -> Any:
+    # int/bool は文字列化やregexを経由せず直接 Decimal 化（str/sort キーを数値列と揃えるため丸めは通す）
+    return Decimal(x).quantize(q)
+
+
+def _as_float(x: float, q: Decimal) -> Any:
+    # floatは文字列経由で誤差を抑える
+    try:
+        d = Decimal(str(x))
+    except Exception:
+        return x
+    return d.quantize(q)
+
+
+def _as_dec(x: Decimal, q: Decimal) -> Any:
+    return x.quantize(q)
+
+
+def _fallback(x: Any, q: Decimal) -> Any:
+    # サブクラス等は従来どおり isinstance で判定
+    if isinstance(x, str):
+        return _as_str(x, q)
+    d = _to_decimal(x)
+    if d is not None:
+        return d.quantize(q)
+    return x
+
+
+_HANDLERS = {
+    type(None): _as_none,
+    int: _as_int,
+    bool: _as_int,
+    str: _as_str,
+    float: _as_float,
+    Decimal: _as_dec,
+}
+
+
 def normalize_value(x: Any, *, float_round: int = 6) -> Any:
     """
     値を比較しやすい形に正規化
@@ -67,20 +132,7 @@ def normalize_value(x: Any, *, float_round: int = 6) -> Any:
     - 文字列はtrim & 空はNone
     - bool/intはそのまま
     """
-    if x is None:
-        return None
-
-    if isinstance(x, str):
-        s = x.strip()
-        return None if s == "" else s
-
-    d = _to_decimal(x)
-    if d is not None:
-        # 小数は丸めて比較
-        q = Decimal("1." + ("0" * float_round))
-        return d.quantize(q)
-
-    return x
+    return _HANDLERS.get(type(x), _fallback)(x, _quantizer(float_round))
 
 
 def normalize_rows(
@@ -89,17 +141,53 @@ def normalize_rows(
     float_round: int = 6,
     ignore_row_order: bool = True,
 ) -> List[Tuple[Any, ...]]:
+    q = _quantizer(float_round)
+    get = _HANDLERS.get
     norm = []
     for r in rows:
-        norm.append(tuple(normalize_value(v, float_round=float_round) for v in r))
+        norm.append(tuple(get(type(v), _fallback)(v, q) for v in r))
 
     if ignore_row_order:
         # 行順無視：ソートして比較
-        norm.sort(key=lambda t: tuple("" if v is None else str(v) for v in t))
+        # キーは各行1回だけ作る（"\x00" 区切りの1文字列にして比較を文字列1回で済ませる）
+        decorated = [("\x00".join("" if v is None else str(v) for v in t), t) for t in norm]
+        decorated.sort(key=itemgetter(0))
+        norm = [t for _, t in decorated]
 
     return norm
 
 
+# これ以上の行数で、両側とも整数だけの結果なら NumPy でまとめてソートして比較する
+_VECTORIZE_MIN_ROWS = 256
+
+
+def _int_matrix(rows: List[Tuple[Any, ...]]) -> np.ndarray | None:
+    """
+    全セルが int（bool/None を除く）の矩形なら、行ソート済みの int64 行列を返す。条件を満たさなければ None。
+    整数は丸めの影響を受けないので Decimal 経路と判定が必ず一致する。
+    float/Decimal は float64 の丸め（2進数の half-to-even）と Decimal の quantize で結果が変わりうるので対象外。
+    """
+    if not rows:
+        return None
+    width = len(rows[0])
+    if width == 0:
+        return None
+    for r in rows:
+        if len(r) != width:
+            return None
+        for v in r:
+            if type(v) is not int:
+                return None
+
+    try:
+        arr = np.array(rows, dtype=np.int64)
+    except OverflowError:
+        # int64 に収まらない値は Decimal の比較に任せる
+        return None
+    order = np.lexsort(arr.T[::-1])
+    return arr[order]
+
+
 def is_single_scalar(rows: List[Tuple[Any, ...]]) -> bool:
     return len(rows) == 1 and len(rows[0]) == 1
 
@@ -116,24 +204,197 @@ def compare_lenient(
     - 行順は無視
     - 数値は丸めて比較
     - 1x1の集計は scalar一致ならOK
+    - 大きな整数だけの結果同士は NumPy でまとめてソートして比較（判定は Decimal 経路と同じ）
     """
-    exp_n = normalize_rows(expected_rows, float_round=float_round, ignore_row_order=True)
-    act_n = normalize_rows(actual_rows, float_round=float_round, ignore_row_order=True)
-
-    # 1x1なら厳密にその値比較だけ
-    if is_single_scalar(exp_n) and is_single_scalar(act_n):
-        return exp_n[0][0] == act_n[0][0]
-
-    # 行数・列数が違うなら基本不一致（ここはまだ“ゆるめ”の範囲）
+    # 行数・列数が違うなら基本不一致（正規化より先に形だけ見て弾く）
     # もっと緩めたいなら「列数が違っても共通部分だけ比較」も可能
-    if len(exp_n) != len(act_n):
+    if len(expected_rows) != len(actual_rows):
         return False
-    if exp_n and act_n and (len(exp_n[0]) != len(act_n[0])):
+    if expected_rows and actual_rows and (len(expected_rows[0]) != len(actual_rows[0])):
         return False
 
+    # 1x1なら厳密にその値比較だけ（2セルだけ正規化）
+    if is_single_scalar(expected_rows) and is_single_scalar(actual_rows):
+        exp_v = normalize_rows(expected_rows, float_round=float_round, ignore_row_order=False)[0][0]
+        act_v = normalize_rows(actual_rows, float_round=float_round, ignore_row_order=False)[0][0]
+        return exp_v == act_v
+
+    if len(expected_rows) >= _VECTORIZE_MIN_ROWS:
+        exp_m = _int_matrix(expected_rows)
+        if exp_m is not None:
+            act_m = _int_matrix(actual_rows)
+            if act_m is not None:
+                return exp_m.shape == act_m.shape and bool(np.array_equal(exp_m, act_m))
+
+    exp_n = normalize_rows(expected_rows, float_round=float_round, ignore_row_order=True)
+    act_n = normalize_rows(actual_rows, float_round=float_round, ignore_row_order=True)
+
     return exp_n == act_n
 
 
+async def _generate_sql(
+    client: httpx.AsyncClient,
+    question: str,
+    *,
+    system_text: str,
+    schema_text: str | None,
+    provider: str,
+    cfg: Dict[str, Any],
+    api_url: str,
+    model: str,
+) -> str:
+    """
+    1ケース分の LLM SQL生成（イベントループ上で他ケースと多重化される。DBには触らない）
+    """
+    bundle = PromptBundle(system=system_text, user=build_user(question, schema_text))
+    if provider == "groq":
+        obj = await call_groq_async(
+            client,
+            system=bundle.system,
+            user=bundle.user,
+            model=cfg.get("groq_model"),  # 任意
+            timeout=120,
+            temperature=0.1,
+            top_p=0.95,
+        )
+    else:
+        obj = await call_lmstudio_async(
+            client,
+            api_url=api_url,
+            model=model,
+            system=bundle.system,
+            user=bundle.user,
+            temperature=0.1,
+            top_p=0.95,
+            timeout=120,
+        )
+    return str(obj.get("sql", "")).strip()
+
+
+QueryResult = Tuple[List[str], List[Tuple[Any, ...]]]
+
+# 参照SQLはLIMITが無く巨大になり得るので、サーバサイドカーソルでこの行数ずつ受け取る
+_REF_BATCH = 1000
+
+
+def _fetch_reference(
+    pool: ConnectionPool, case: Dict[str, Any], *, max_compare_rows: int
+) -> QueryResult | Exception:
+    """
+    1ケース分の参照SQLをサーバサイドカーソルで max_compare_rows 行まで読む（失敗はそのケースだけの例外として返す）。
+    """
+    try:
+        with pool.connection() as conn:
+            return run_query(conn, str(case["reference_sql"]), batch=_REF_BATCH, max_rows=max_compare_rows)
+    except Exception as e:
+        return e
+
+
+async def _run_cases(
+    pool: ConnectionPool,
+    cases: List[Dict[str, Any]],
+    *,
+    workers: int,
+    max_compare_rows: int,
+    gen_kwargs: Dict[str, Any],
+    eval_kwargs: Dict[str, Any],
+) -> List[CaseResult | None]:
+    """
+    LLM呼び出しは1つの AsyncClient(http2) 上で最大 workers 件まで同時に投げる。
+    参照SQLは同じ枠の中で LLM 呼び出しと並行してスレッドで流す（同時に持つ参照結果は概ね workers 件まで）。
+    判定は終わったケースから順に1件ずつ行う。
+    """
+    slots: List[CaseResult | None] = [None] * len(cases)
+    sem = asyncio.Semaphore(workers)
+
+    async with make_async_client(timeout=120) as client:
+
+        async def handle(i: int, case: Dict[str, Any]) -> Tuple[int, QueryResult | Exception, str | Exception]:
+            async with sem:
+                LOGGER.info("CASE %s: %s", case["id"], case["question"])
+                ref_task = asyncio.create_task(
+                    asyncio.to_thread(_fetch_reference, pool, case, max_compare_rows=max_compare_rows)
+                )
+                try:
+                    generated: str | Exception = await _generate_sql(client, str(case["question"]), **gen_kwargs)
+                except Exception as e:
+                    generated = e
+                ref = await ref_task
+            return i, ref, generated
+
+        for fut in asyncio.as_completed([handle(i, case) for i, case in enumerate(cases)]):
+            i, ref, generated = await fut
+            slots[i] = await asyncio.to_thread(
+                _evaluate_case,
+                pool,
+                cases[i],
+                ref,
+                generated,
+                max_compare_rows=max_compare_rows,
+                **eval_kwargs,
+            )
+
+    return slots
+
+
+def _evaluate_case(
+    pool: ConnectionPool,
+    case: Dict[str, Any],
+    ref: QueryResult | Exception,
+    generated: str | Exception,
+    *,
+    dialect: str,
+    max_limit: int,
+    max_compare_rows: int,
+    float_round: int,
+    show_mismatch: bool,
+) -> CaseResult:
+    """
+    生成済みSQL（または生成時の例外）を受け取り、参照SQLと実行結果を比較する。
+    """
+    cid = int(case["id"])
+    question = str(case["question"])
+    ref_sql = str(case["reference_sql"])
+
+    # 参照SQL（正解）
+    if isinstance(ref, Exception):
+        return CaseResult(cid, ok_exec=False, ok_match=False, guard_rejected=False, error=f"ref_sql error: {ref}")
+    ref_cols, ref_rows = ref
+
+    # LLM SQL生成の結果
+    if isinstance(generated, Exception):
+        return CaseResult(cid, ok_exec=False, ok_match=False, guard_rejected=False, error=f"lmstudio error: {generated}")
+    sql_raw = generated
+
+    # ガード
+    try:
+        sql_safe = guard_sql(sql_raw, dialect=dialect, max_limit=max_limit)
+    except Exception as e:
+        return CaseResult(cid, ok_exec=False, ok_match=False, guard_rejected=True, error=f"guard: {e}")
+
+    # 実行
+    try:
+        with pool.connection() as conn:
+            out_cols, out_rows = run_query(conn, sql_safe, max_rows=max_compare_rows)
+    except Exception as e:
+        return CaseResult(cid, ok_exec=False, ok_match=False, guard_rejected=False, error=f"exec: {e}")
+
+    # 参照側の正規化もここで（形が違う・1x1・整数だけの大きな結果なら compare_lenient が正規化を省く）
+    ok_match = compare_lenient(ref_rows, out_rows, float_round=float_round)
+
+    if show_mismatch and not ok_match:
+        print("\n--- MISMATCH CASE", cid, "---")
+        print("Q:", question)
+        print("\n[LLM SQL]\n", sql_safe)
+        print("\n[Expected SQL]\n", ref_sql)
+        print("\n[LLM Result]")
+        print(format_table(out_cols, out_rows))
+        print("\n[Expected Result]")
+        print(format_table(ref_cols, ref_rows))
+
+    return CaseResult(cid, ok_exec=True, ok_match=ok_match, guard_rejected=False, error=None)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--questions", type=str, default="eval/questions_ja.jsonl")
@@ -142,9 +403,11 @@ def main() -> None:
     parser.add_argument("--float-round", type=int, default=6, help="数値の丸め桁（小数）")
     parser.add_argument("--show-mismatch", action="store_true", help="不一致ケースの詳細を表示")
     parser.add_argument("--provider", type=str, default="lmstudio", choices=["lmstudio", "groq"])
+    parser.add_argument("--no-schema-cache", action="store_true", help="スキーマのディスクキャッシュを使わない")
+    parser.add_argument("--workers", type=int, default=4, help="LLM呼び出しの並列数")
+    parser.add_argument("--max-compare-rows", type=int, default=10_000, help="比較に使う最大行数（参照SQLの暴走対策）")
     args = parser.parse_args()
 
-    logger = _ensure_logger()
     cfg = get_config()
 
     api_url = cfg["api_url"]
@@ -167,87 +430,40 @@ def main() -> None:
                 continue
             cases.append(json.loads(line))
 
-    results: List[CaseResult] = []
-    with psycopg.connect(dsn) as conn:
-        schema_text = fetch_schema_summary(conn) if args.introspect else None
-
-        for case in cases:
-            cid = int(case["id"])
-            question = str(case["question"])
-            ref_sql = str(case["reference_sql"])
-
-            logger.info("CASE %s: %s", cid, question)
-
-            # 参照SQL（正解）
-            try:
-                ref_cols, ref_rows = run_query(conn, ref_sql)
-            except Exception as e:
-                results.append(
-                    CaseResult(cid, ok_exec=False, ok_match=False, guard_rejected=False, error=f"ref_sql error: {e}")
-                )
-                continue
-
-            bundle = build_text2sql_messages(
-                question,
-                dialect=dialect,
-                schema=schema_text,
-                max_limit=args.max_limit,
+    workers = max(1, args.workers)
+    # 参照SQLと候補SQLが別バックエンドで同時に走れるようプールを使う
+    with ConnectionPool(dsn, min_size=2, max_size=workers + 2, open=True) as pool:
+        schema_text = None
+        if args.introspect:
+            with pool.connection() as conn:
+                schema_text = fetch_schema_summary(conn, use_cache=not args.no_schema_cache)
+        # system は質問に依存しないのでループ外で1回だけ作る
+        system_text = build_system(dialect, args.max_limit)
+
+        slots = asyncio.run(
+            _run_cases(
+                pool,
+                cases,
+                workers=workers,
+                max_compare_rows=args.max_compare_rows,
+                gen_kwargs={
+                    "system_text": system_text,
+                    "schema_text": schema_text,
+                    "provider": args.provider,
+                    "cfg": cfg,
+                    "api_url": api_url,
+                    "model": model,
+                },
+                eval_kwargs={
+                    "dialect": dialect,
+                    "max_limit": args.max_limit,
+                    "float_round": args.float_round,
+                    "show_mismatch": args.show_mismatch,
+                },
             )
+        )
 
-            # LLM SQL生成
-            try:
-                if args.provider == "groq":
-                    obj = call_groq_text2sql(
-                        system=bundle.system,
-                        user=bundle.user,
-                        model=cfg.get("groq_model"),  # 任意
-                        timeout=120,
-                        temperature=0.1,
-                        top_p=0.95,
-                    )
-                else:
-                    obj = call_lmstudio_text2sql(
-                        api_url=api_url,
-                        model=model,
-                        system=bundle.system,
-                        user=bundle.user,
-                        temperature=0.1,
-                        top_p=0.95,
-                        timeout=120,
-                    )
-                sql_raw = str(obj.get("sql", "")).strip()
-            except Exception as e:
-                results.append(
-                    CaseResult(cid, ok_exec=False, ok_match=False, guard_rejected=False, error=f"lmstudio error: {e}")
-                )
-                continue
-
-            # ガード
-            try:
-                sql_safe = guard_sql(sql_raw, dialect=dialect, max_limit=args.max_limit)
-            except Exception as e:
-                results.append(CaseResult(cid, ok_exec=False, ok_match=False, guard_rejected=True, error=f"guard: {e}"))
-                continue
-
-            # 実行
-            try:
-                out_cols, out_rows = run_query(conn, sql_safe)
-            except Exception as e:
-                results.append(CaseResult(cid, ok_exec=False, ok_match=False, guard_rejected=False, error=f"exec: {e}"))
-                continue
-
-            ok_match = compare_lenient(ref_rows, out_rows, float_round=args.float_round)
-            results.append(CaseResult(cid, ok_exec=True, ok_match=ok_match, guard_rejected=False, error=None))
-
-            if args.show_mismatch and not ok_match:
-                print("\n--- MISMATCH CASE", cid, "---")
-                print("Q:", question)
-                print("\n[LLM SQL]\n", sql_safe)
-                print("\n[Expected SQL]\n", ref_sql)
-                print("\n[LLM Result]")
-                print(format_table(out_cols, out_rows))
-                print("\n[Expected Result]")
-                print(format_table(ref_cols, ref_rows))
+    results: List[CaseResult] = [r for r in slots if r is not None]
 
     total = len(results)
     exec_ok = sum(1 for r in results if r.ok_exec)
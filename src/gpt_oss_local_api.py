@@ -7,7 +7,8 @@ import os
 from functools import lru_cache
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
-from typing import Any, Dict, Optional
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
 
 import requests
 
@@ -28,8 +29,17 @@ def load_config(path: str) -> Dict[str, Any]:
         return json.load(f)
 
 
-@lru_cache(maxsize=1)
-def get_config(path: Optional[str] = None) -> Dict[str, Any]:
+def _freeze(obj: Any) -> Any:
+    """dict → MappingProxyType、list → tuple に再帰的に変換（キャッシュ共有する設定を呼び出し側が壊せないように）"""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+
+@lru_cache(maxsize=8)
+def _resolve_path(path: Optional[str], env: Optional[str]) -> str:
     """
     設定の探索順：
       1) 引数 path
@@ -40,8 +50,8 @@ def get_config(path: Optional[str] = None) -> Dict[str, Any]:
     candidates: list[Path] = []
     if path:
         candidates.append(Path(path))
-    if os.getenv("CONFIG_JSON"):
-        candidates.append(Path(os.getenv("CONFIG_JSON", "")))
+    if env:
+        candidates.append(Path(env))
     candidates.append(Path.cwd() / "config" / "setting.json")
     candidates.append(Path(__file__).resolve().parent / "config" / "setting.json")
 
@@ -49,11 +59,25 @@ def get_config(path: Optional[str] = None) -> Dict[str, Any]:
     for p in candidates:
         tried.append(str(p))
         if p.is_file():
-            return load_config(str(p))
+            return str(p.resolve())
 
     raise FileNotFoundError("setting.json not found. tried: " + " | ".join(tried))
 
 
+@lru_cache(maxsize=8)
+def _load(resolved: str) -> Mapping[str, Any]:
+    """解決済みの絶対パスごとに1回だけ読む（読み取り専用で返す）"""
+    return _freeze(load_config(resolved))
+
+
+def get_config(path: Optional[str] = None) -> Mapping[str, Any]:
+    """
+    設定を読み取り専用の Mapping で返す（探索順は _resolve_path を参照）。
+    path の渡し方が違っても同じファイルなら同じキャッシュを返す。
+    """
+    return _load(_resolve_path(path, os.getenv("CONFIG_JSON")))
+
+
 # =========================
 # ロガー（回転ログ・遅延初期化）
 # =========================
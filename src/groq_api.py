@@ -3,40 +3,86 @@ from __future__ import annotations
 
 import json
 import os
-import re
 import time
 from typing import Any, Dict, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
 from src.gpt_oss_local_api import _extract_content
 
 GROQ_BASE_URL = "https://api.groq.com/openai/v1"
 DEFAULT_TIMEOUT = 120
 
+# TCP/TLS ハンドシェイクを毎回やらないよう、モジュール共通の Session を使い回す
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
 
-def _extract_json_object(text: str) -> Optional[Dict[str, Any]]:
+def _scan_braced(text: str) -> Optional[str]:
+    """
+    最初の { から対応する } までを1パスで切り出す（文字列リテラル内の括弧とエスケープは無視）。
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    depth = 0
+    in_str = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start : i + 1]
+    return None
+
+
+def _extract_json_object(text: str, allow_salvage: bool = True) -> Optional[Dict[str, Any]]:
     """
     content がJSON以外を含んでいても、最初の { ... } を抜き出して parse する救済。
+    allow_salvage=False（strict な json_schema でJSONが保証されている場合）は救済しない。
     """
     if not text:
         return None
 
     # そのままJSONとして読めるか
     try:
-        obj = json.loads(text)
+        obj = _loads(text)
         if isinstance(obj, dict):
             return obj
     except Exception:
         pass
 
+    if not allow_salvage:
+        return None
+
     # { ... } の塊を拾う（最短救済）
-    m = re.search(r"\{.*\}", text, flags=re.DOTALL)
-    if not m:
+    braced = _scan_braced(text)
+    if braced is None:
         return None
 
     try:
-        obj = json.loads(m.group(0))
+        obj = _loads(braced)
         if isinstance(obj, dict):
             return obj
     except Exception:
@@ -45,6 +91,19 @@ def _extract_json_object(text: str) -> Optional[Dict[str, Any]]:
     return None
 
 
+# 一時エラー扱いでリトライするステータス
+_RETRY_STATUSES = (429, 503, 504)
+
+
+def _retry_sleep(attempt: int, *, failed: bool) -> float:
+    """
+    バックオフ秒数（短め）。failed=True は例外、False は一時エラーのステータス。
+    """
+    if failed:
+        return min(1.0 * (2**attempt), 6.0)
+    return min(2.0 * (2**attempt), 8.0)
+
+
 def _post_with_retry(
     url: str,
     headers: Dict[str, str],
@@ -59,41 +118,32 @@ def _post_with_retry(
     last_exc: Optional[Exception] = None
     for i in range(max_retries + 1):
         try:
-            r = requests.post(url, headers=headers, json=payload, timeout=timeout)
-            if r.status_code in (429, 503, 504):
+            r = _SESSION.post(url, headers=headers, json=payload, timeout=timeout)
+            if r.status_code in _RETRY_STATUSES:
                 # Backoff（短め）
-                sleep_s = min(2.0 * (2**i), 8.0)
-                time.sleep(sleep_s)
+                time.sleep(_retry_sleep(i, failed=False))
                 continue
             return r
         except Exception as e:
             last_exc = e
-            sleep_s = min(1.0 * (2**i), 6.0)
-            time.sleep(sleep_s)
+            time.sleep(_retry_sleep(i, failed=True))
             continue
     if last_exc:
         raise last_exc
     raise RuntimeError("request failed without exception")
 
 
-def call_groq_text2sql(
+def _groq_request(
     *,
     system: str,
     user: str,
-    model: Optional[str] = None,
-    api_key: Optional[str] = None,
-    timeout: int = DEFAULT_TIMEOUT,
-    temperature: float = 0.1,
-    top_p: float = 0.95,
-) -> Dict[str, Any]:
+    model: Optional[str],
+    api_key: Optional[str],
+    temperature: float,
+    top_p: float,
+) -> Tuple[str, Dict[str, str], Dict[str, Any], Dict[str, Any]]:
     """
-    Groq OpenAI互換 /chat/completions を叩いて
-    {"sql": "...", "assumptions": [...]} を返す。
-
-    方針:
-    1) json_schema を試す（対応モデルなら最強）
-    2) 400で非対応なら json_object にフォールバック
-    3) contentが壊れてても {..} 抽出で救済
+    (url, headers, json_schema版payload, json_object版payload) を組み立てる。
     """
     key = api_key or os.getenv("GROQ_API_KEY")
     if not key:
@@ -148,29 +198,36 @@ def call_groq_text2sql(
         },
     }
 
-    r = _post_with_retry(url, headers, payload_schema, timeout=timeout)
+    payload_object = {
+        **base_payload,
+        "messages": [
+            {"role": "system", "content": system_json_only},
+            {"role": "user", "content": user},
+        ],
+        "response_format": {"type": "json_object"},
+    }
+    return url, headers, payload_schema, payload_object
+
+
+def _json_schema_unsupported(status_code: int, text: str) -> bool:
+    return status_code == 400 and "does not support response format `json_schema`" in text
+
+
+def _strict_output(payload: Dict[str, Any]) -> bool:
+    """strict な json_schema のときだけ応答が純粋なJSONだと言える（{ ... } 救済は不要）"""
+    fmt = payload.get("response_format") or {}
+    return bool(fmt.get("json_schema", {}).get("strict"))
+
+
+def _parse_groq_response(status_code: int, text: str, data: Any, *, allow_salvage: bool = True) -> Dict[str, Any]:
+    if status_code != 200:
+        raise RuntimeError(f"Groq returned {status_code}: {text[:500]}")
 
-    # 400で json_schema 非対応なら json_object にフォールバック
-    if r.status_code == 400 and "does not support response format `json_schema`" in r.text:
-        payload_object = {
-            **base_payload,
-            "messages": [
-                {"role": "system", "content": system_json_only},
-                {"role": "user", "content": user},
-            ],
-            "response_format": {"type": "json_object"},
-        }
-        r = _post_with_retry(url, headers, payload_object, timeout=timeout)
-
-    if r.status_code != 200:
-        raise RuntimeError(f"Groq returned {r.status_code}: {r.text[:500]}")
-
-    data = r.json()
     content = _extract_content(data)
     if not content:
         raise RuntimeError("Groq: no content in response")
 
-    obj = _extract_json_object(content)
+    obj = _extract_json_object(content, allow_salvage=allow_salvage)
     if not obj or "sql" not in obj:
         raise RuntimeError("Groq: response is not valid JSON or missing 'sql'")
 
@@ -180,3 +237,38 @@ def call_groq_text2sql(
         out["assumptions"] = [str(x) for x in obj["assumptions"]]
 
     return out
+
+
+def call_groq_text2sql(
+    *,
+    system: str,
+    user: str,
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    timeout: int = DEFAULT_TIMEOUT,
+    temperature: float = 0.1,
+    top_p: float = 0.95,
+) -> Dict[str, Any]:
+    """
+    Groq OpenAI互換 /chat/completions を叩いて
+    {"sql": "...", "assumptions": [...]} を返す。
+
+    方針:
+    1) json_schema を試す（対応モデルなら最強）
+    2) 400で非対応なら json_object にフォールバック
+    3) strict でない応答（json_object / strict=False の json_schema）は、contentが壊れてても {..} 抽出で救済
+    """
+    url, headers, payload_schema, payload_object = _groq_request(
+        system=system, user=user, model=model, api_key=api_key, temperature=temperature, top_p=top_p
+    )
+
+    payload = payload_schema
+    r = _post_with_retry(url, headers, payload, timeout=timeout)
+
+    # 400で json_schema 非対応なら json_object にフォールバック
+    if _json_schema_unsupported(r.status_code, r.text):
+        payload = payload_object
+        r = _post_with_retry(url, headers, payload, timeout=timeout)
+
+    data = r.json() if r.status_code == 200 else None
+    return _parse_groq_response(r.status_code, r.text, data, allow_salvage=not _strict_output(payload))
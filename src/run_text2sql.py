@@ -4,10 +4,31 @@ from __future__ import annotations
 import argparse
 import json
 import re
+import uuid
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
 from typing import Any, Dict, List, Tuple, Optional
 
 import psycopg
+import requests
 import sqlglot
+from requests.adapters import HTTPAdapter
+from sqlglot import exp
+from sqlglot.dialects.dialect import Dialect
+from sqlglot.tokens import Token, TokenType
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import hyperscan  # 任意依存（入っていれば guard_sql の禁止パターン走査に使う）
+except ImportError:
+    hyperscan = None
 
 from src.gpt_oss_local_api import get_config, _ensure_logger, _extract_content, ERROR_MESSAGE  # type: ignore
 from src.text2sql_prompt import build_text2sql_messages
@@ -17,6 +38,9 @@ from src.groq_api import call_groq_text2sql
 from dotenv import load_dotenv
 load_dotenv()
 
+# ロガーは import 時に1度だけ用意して、リクエストごとの _ensure_logger() 呼び出しを省く
+LOGGER = _ensure_logger()
+
 FORBIDDEN_PATTERNS = [
     r";\s*\S",  # 複数ステートメントっぽい
     r"\b(insert|update|delete|merge|create|alter|drop|truncate|grant|revoke)\b",
@@ -26,10 +50,72 @@ FORBIDDEN_PATTERNS = [
     r"\bcross\s+join\b",
 ]
 
+# LM Studio への接続を使い回す（評価で同じホストへ何度も投げるので keep-alive が効く）
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+# 全パターンを1本の正規表現にまとめ、1パスで走査する（名前付きグループで元パターンに戻す）
+_FORBIDDEN_LABELS = tuple(FORBIDDEN_PATTERNS)
+_FORBIDDEN_RE = re.compile(
+    "|".join(f"(?P<p{i}>{p})" for i, p in enumerate(FORBIDDEN_PATTERNS)),
+    re.IGNORECASE,
+)
+
+_SET_OPERATIONS = (TokenType.UNION, TokenType.INTERSECT, TokenType.EXCEPT)
+
+
+def _compile_forbidden_hyperscan() -> Any:
+    """
+    FORBIDDEN_PATTERNS を Hyperscan の1つのDBにまとめる。使えなければ None。
+    （バイト列で走査するので \\b は ASCII 基準。非ASCII直後の語は re より厳しめに落ちる）
+    """
+    if hyperscan is None:
+        return None
+    flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[p.encode() for p in FORBIDDEN_PATTERNS],
+            ids=list(range(len(FORBIDDEN_PATTERNS))),
+            elements=len(FORBIDDEN_PATTERNS),
+            flags=[flags] * len(FORBIDDEN_PATTERNS),
+        )
+    except Exception:
+        return None
+    return db
+
+
+_FORBIDDEN_HS = _compile_forbidden_hyperscan()
+
+
+def _find_forbidden(s: str) -> Optional[str]:
+    """
+    禁止パターンに当たれば元のパターン文字列を返す（無ければ None）。
+    Hyperscan があればそちら、無ければ結合済みの正規表現で1パス走査する。
+    """
+    if _FORBIDDEN_HS is not None:
+        hits: List[int] = []
+
+        def on_match(pid: int, start: int, end: int, flags: int, context: Any) -> bool:
+            hits.append(pid)
+            return True  # 最初の1件で打ち切る
+
+        try:
+            _FORBIDDEN_HS.scan(s.encode("utf-8"), match_event_handler=on_match)
+        except hyperscan.ScanTerminated:
+            pass
+        return _FORBIDDEN_LABELS[hits[0]] if hits else None
+
+    m = _FORBIDDEN_RE.search(s)
+    if m:
+        return _FORBIDDEN_LABELS[int(m.lastgroup[1:])]
+    return None
+
 
 def _json_from_content(content: str) -> Optional[Dict[str, Any]]:
     try:
-        return json.loads(content)
+        return _loads(content)
     except Exception:
         return None
 
@@ -39,56 +125,217 @@ def guard_sql(sql: str, *, dialect: str = "postgres", max_limit: int = 100) -> s
     - SELECTのみ許可
     - 危険語や複数文を拒否
     - LIMITがなければ追加（max_limit）
+    同じ入力には同じ結果を返す決定的な関数なので、結果をキャッシュする（拒否は例外なのでキャッシュされない）。
     """
+    return _guard_sql_cached(sql, dialect, max_limit)
+
+
+@lru_cache(maxsize=4096)
+def _guard_sql_cached(sql: str, dialect: str, max_limit: int) -> str:
     s = sql.strip()
     if not s:
         raise ValueError("empty sql")
 
     # 軽い正規表現ガード（早期に落とす）
-    lowered = s.lower()
-    for pat in FORBIDDEN_PATTERNS:
-        if re.search(pat, lowered):
-            raise ValueError(f"forbidden pattern detected: {pat}")
+    pat = _find_forbidden(s)
+    if pat:
+        raise ValueError(f"forbidden pattern detected: {pat}")
 
-    # sqlglotで構文解析し、SELECTのみを保証
+    # トークン化は1回だけ。構文の検査（SELECT のみ）はそのトークン列を構文解析して行い、
+    # トップレベルの LIMIT の位置はトークン列から取る（AST を文字列に戻さず元の SQL を最小限だけ書き換える）
     try:
-        expr = sqlglot.parse_one(s, read=dialect)
+        tokens = sqlglot.tokenize(s, read=dialect)
     except Exception as e:
         raise ValueError(f"sql parse failed: {e}") from e
 
-    if expr is None:
+    if not tokens:
+        raise ValueError("sql parse returned None")
+
+    _check_select(_parse_tokens(tokens, s, dialect))
+
+    shape = _scan_top_level_limit(tokens)
+    if shape is None:
+        # 括弧始まりなど判定しきれない形だけ AST から LIMIT を調べる
+        return _guard_with_parse(s, dialect, max_limit)
+    return _apply_limit(s, tokens, shape, max_limit)
+
+
+def _parse_tokens(tokens: List[Token], s: str, dialect: str) -> Any:
+    """sqlglot.parse_one と同じ判定を、トークン化済みの列から行う（トークナイザを2回通さない）"""
+    try:
+        result = Dialect.get_or_raise(dialect).parser().parse(tokens, s)
+    except Exception as e:
+        raise ValueError(f"sql parse failed: {e}") from e
+    if not result or result[0] is None:
         raise ValueError("sql parse returned None")
+    return exp.Block(expressions=result) if len(result) > 1 else result[0]
+
 
+def _check_select(expr: Any) -> None:
     # Select 以外は拒否
     if expr.key != "select":
         raise ValueError(f"only SELECT is allowed, got: {expr.key}")
 
-    # LIMITが無ければ付与 / あれば上限を絞る
-    has_limit = expr.args.get("limit") is not None
+
+def _scan_top_level_limit(tokens: List[Token]) -> Optional[Tuple[bool, Optional[Token]]]:
+    """
+    SELECT/WITH で始まる単一の SELECT かをトークン列だけで判定する。
+    戻り値は (トップレベルにLIMIT/FETCHがあるか, LIMIT キーワードのトークン（直後が数値のときだけ）)。
+    判定できない形（括弧始まり・UNION等の集合演算・括弧の不整合）は None。
+    """
+    if tokens[0].token_type not in (TokenType.SELECT, TokenType.WITH):
+        return None
+
+    depth = 0
+    has_select = False
+    has_limit = False
+    limit_tok: Optional[Token] = None
+    for i, tok in enumerate(tokens):
+        tt = tok.token_type
+        if tt == TokenType.L_PAREN:
+            depth += 1
+        elif tt == TokenType.R_PAREN:
+            depth -= 1
+            if depth < 0:
+                return None
+        elif depth == 0:
+            if tt in _SET_OPERATIONS:
+                return None
+            if tt == TokenType.SELECT:
+                has_select = True
+            elif tt in (TokenType.LIMIT, TokenType.FETCH):
+                has_limit = True
+                nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+                if tt == TokenType.LIMIT and nxt is not None and nxt.token_type == TokenType.NUMBER:
+                    limit_tok = tok
+                else:
+                    limit_tok = None
+
+    if depth != 0 or not has_select:
+        return None
+    return has_limit, limit_tok
+
+
+def _apply_limit(
+    s: str, tokens: List[Token], shape: Tuple[bool, Optional[Token]], max_limit: int
+) -> str:
+    """
+    LIMITが無ければ付与 / あれば上限を絞る（非数値の LIMIT と FETCH はそのまま）。
+    どちらの経路でも書き換えた箇所は "LIMIT n" の形に揃え、サブクエリやコメント内の LIMIT には触らない。
+    """
+    has_limit, limit_tok = shape
     if not has_limit:
-        s2 = s.rstrip().rstrip(";") + f" LIMIT {max_limit}"
-        return s2
+        # 末尾の ; は落とし、末尾の行コメントより前に差し込む（後ろに付けるとコメントに飲まれる）
+        last = next(t for t in reversed(tokens) if t.token_type != TokenType.SEMICOLON)
+        head, tail = s[: last.end + 1], s[last.end + 1 :].rstrip().rstrip(";").rstrip()
+        return f"{head} LIMIT {max_limit}{tail}"
+
+    if limit_tok is not None:
+        num = tokens[tokens.index(limit_tok) + 1]
+        if num.text.isdigit() and int(num.text) > max_limit:
+            return s[: limit_tok.start] + f"LIMIT {max_limit}" + s[num.end + 1 :]
+    return s
+
+
+def _guard_with_parse(s: str, dialect: str, max_limit: int) -> str:
+    """
+    sqlglotで構文解析し、SELECTのみを保証する（トークン判定できない形のフォールバック）。
+    LIMIT の有無は AST から取り、書き換えはトークン経路と同じ _apply_limit で行う。
+    """
+    try:
+        expr = sqlglot.parse_one(s, read=dialect)
+    except Exception as e:
+        raise ValueError(f"sql parse failed: {e}") from e
+
+    if expr is None:
+        raise ValueError("sql parse returned None")
+    _check_select(expr)
+
+    tokens = sqlglot.tokenize(s, read=dialect)
+    limit = expr.args.get("limit")
+    if limit is None:
+        return _apply_limit(s, tokens, (False, None), max_limit)
+
+    # 数値の LIMIT なら、トップレベル（括弧の外）で最後に出てくる LIMIT キーワードがそれ
+    limit_tok: Optional[Token] = None
+    val = limit.args.get("expression") if isinstance(limit, exp.Limit) else None
+    if val is not None and val.is_int:
+        depth = 0
+        for i, tok in enumerate(tokens):
+            tt = tok.token_type
+            if tt == TokenType.L_PAREN:
+                depth += 1
+            elif tt == TokenType.R_PAREN:
+                depth -= 1
+            elif depth == 0 and tt == TokenType.LIMIT and i + 1 < len(tokens):
+                if tokens[i + 1].token_type == TokenType.NUMBER:
+                    limit_tok = tok
+    return _apply_limit(s, tokens, (True, limit_tok), max_limit)
+
+
+SCHEMA_CACHE_DIR = Path.home() / ".cache" / "text2sql"
+
+
+def fetch_schema_version(conn: psycopg.Connection, *, schema: str = "public") -> Optional[str]:
+    """
+    スキーマ変更検知用の軽いハッシュ。
+    information_schema ではなく pg_catalog を直接読むので安い。
+    （テーブル/カラムの追加・削除・リネーム・型変更で値が変わる）
+    """
+    q = """
+    SELECT md5(string_agg(
+             c.oid::text || c.relname || a.attnum::text || a.attname || a.atttypid::text,
+             ',' ORDER BY c.oid, a.attnum))
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid
+    WHERE c.relnamespace = %s::regnamespace
+      AND a.attnum > 0
+      AND NOT a.attisdropped
+    """
+    row = conn.execute(q, (schema,)).fetchone()
+    return row[0] if row else None
+
+
+def _schema_cache_path(conn: psycopg.Connection, schema: str) -> Path:
+    return SCHEMA_CACHE_DIR / f"schema_{conn.info.dbname}_{schema}.json"
 
-    # 既存LIMITが数値なら上限をmax_limitに丸める（非数値はそのまま）
+
+def _load_schema_cache(path: Path, version: str) -> Optional[str]:
     try:
-        limit_expr = expr.args["limit"]
-        limit_val = limit_expr.args.get("expression")
-        if limit_val and limit_val.is_int:
-            n = int(limit_val.this)
-            if n > max_limit:
-                s2 = re.sub(r"\blimit\s+\d+\b", f"LIMIT {max_limit}", s, flags=re.IGNORECASE)
-                return s2
+        with open(path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
     except Exception:
-        pass
+        return None
+    text = cached.get(version) if isinstance(cached, dict) else None
+    return text if isinstance(text, str) else None
 
-    return s
 
+def _save_schema_cache(path: Path, version: str, text: str) -> None:
+    # キャッシュは失敗しても致命的ではないので握りつぶす
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({version: text}, f, ensure_ascii=False)
+    except Exception:
+        pass
 
-def fetch_schema_summary(conn: psycopg.Connection, *, schema: str = "public") -> str:
+
+def fetch_schema_summary(conn: psycopg.Connection, *, schema: str = "public", use_cache: bool = True) -> str:
     """
     information_schema からテーブル/カラムの概要だけ取ってプロンプトに入れる用。
     （本格的にやるなら型やPK/FKも入れるが、まずは軽量に）
+    use_cache=True なら fetch_schema_version が変わらない限りディスクキャッシュを返す。
     """
+    version: Optional[str] = None
+    cache_path: Optional[Path] = None
+    if use_cache:
+        version = fetch_schema_version(conn, schema=schema)
+        if version:
+            cache_path = _schema_cache_path(conn, schema)
+            cached = _load_schema_cache(cache_path, version)
+            if cached is not None:
+                return cached
+
     q = """
     SELECT table_name, column_name, data_type
     FROM information_schema.columns
@@ -109,27 +356,22 @@ def fetch_schema_summary(conn: psycopg.Connection, *, schema: str = "public") ->
             lines.append(f"  {c} {dt},")
         lines.append(");")
         lines.append("")
-    return "\n".join(lines).strip()
+    text = "\n".join(lines).strip()
 
+    if cache_path is not None and version:
+        _save_schema_cache(cache_path, version, text)
+    return text
 
-def call_lmstudio_text2sql(
+
+def _lmstudio_payload(
     *,
-    api_url: str,
     model: str,
     system: str,
     user: str,
-    temperature: float = 0.1,
-    top_p: float = 0.95,
-    timeout: int = 120,
+    temperature: float,
+    top_p: float,
 ) -> Dict[str, Any]:
-    """
-    LM Studio の /v1/chat/completions を叩いて structured JSON を受け取る。
-    """
-    import requests
-
-    logger = _ensure_logger()
-
-    payload = {
+    return {
         "model": model,
         "messages": [
             {"role": "system", "content": system},
@@ -154,13 +396,8 @@ def call_lmstudio_text2sql(
         },
     }
 
-    logger.info("POST %s model=%s", api_url, model)
-    res = requests.post(api_url, json=payload, timeout=timeout)
-    if res.status_code != 200:
-        logger.warning("non-200: %s", res.text[:500])
-        raise RuntimeError(f"LM Studio returned {res.status_code}")
 
-    data = res.json()
+def _parse_lmstudio_response(data: Dict[str, Any]) -> Dict[str, Any]:
     content = _extract_content(data)
     if not content:
         raise RuntimeError("no content in response")
@@ -172,28 +409,70 @@ def call_lmstudio_text2sql(
     return obj
 
 
-def run_query(conn: psycopg.Connection, sql: str) -> Tuple[List[str], List[Tuple[Any, ...]]]:
-    with conn.cursor() as cur:
+def call_lmstudio_text2sql(
+    *,
+    api_url: str,
+    model: str,
+    system: str,
+    user: str,
+    temperature: float = 0.1,
+    top_p: float = 0.95,
+    timeout: int = 120,
+) -> Dict[str, Any]:
+    """
+    LM Studio の /v1/chat/completions を叩いて structured JSON を受け取る。
+    """
+    payload = _lmstudio_payload(model=model, system=system, user=user, temperature=temperature, top_p=top_p)
+
+    LOGGER.info("POST %s model=%s", api_url, model)
+    res = _SESSION.post(api_url, json=payload, timeout=timeout)
+    if res.status_code != 200:
+        LOGGER.warning("non-200: %s", res.text[:500])
+        raise RuntimeError(f"LM Studio returned {res.status_code}")
+
+    return _parse_lmstudio_response(res.json())
+
+
+def run_query(
+    conn: psycopg.Connection,
+    sql: str,
+    *,
+    batch: Optional[int] = None,
+    max_rows: Optional[int] = None,
+) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+    """
+    batch を指定するとサーバサイドカーソルで batch 行ずつ受け取る（巨大な結果でもメモリを抑える）。
+    max_rows を指定するとそれ以上の行は読まない。
+    """
+    if batch is None:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            rows = cur.fetchmany(max_rows) if max_rows is not None else cur.fetchall()
+            cols = [d.name for d in cur.description] if cur.description else []
+            return cols, rows
+
+    with conn.cursor(name=f"t2s_{uuid.uuid4().hex}") as cur:
+        cur.itersize = batch
         cur.execute(sql)
-        rows = cur.fetchall()
+        rows = list(islice(cur, max_rows)) if max_rows is not None else list(cur)
         cols = [d.name for d in cur.description] if cur.description else []
         return cols, rows
 
 
 def format_table(cols: List[str], rows: List[Tuple[Any, ...]], max_rows: int = 30) -> str:
     show = rows[:max_rows]
-    col_widths = [len(c) for c in cols]
-    for r in show:
-        for i, v in enumerate(r):
-            col_widths[i] = max(col_widths[i], len(str(v)))
+    # str() は1セル1回だけ。幅計算と整形は同じ文字列行列を使う
+    scols = [str(c) for c in cols]
+    srows = [[str(v) for v in r] for r in show]
+    col_widths = [max(len(scols[i]), max((len(r[i]) for r in srows), default=0)) for i in range(len(scols))]
 
-    def fmt_row(vals):
-        return " | ".join(str(v).ljust(col_widths[i]) for i, v in enumerate(vals))
+    def fmt_row(vals: List[str]) -> str:
+        return " | ".join(v.ljust(col_widths[i]) for i, v in enumerate(vals))
 
     sep = "-+-".join("-" * w for w in col_widths)
-    out = [fmt_row(cols), sep]
-    for r in show:
-        out.append(fmt_row(list(r)))
+    out = [fmt_row(scols), sep]
+    for r in srows:
+        out.append(fmt_row(r))
 
     if len(rows) > max_rows:
         out.append(f"... ({len(rows) - max_rows} more rows)")
@@ -208,8 +487,6 @@ def main() -> None:
     parser.add_argument("--provider", type=str, default="lmstudio", choices=["lmstudio", "groq"])
     args = parser.parse_args()
 
-    logger = _ensure_logger()
-
     cfg = get_config()
     api_url = cfg["api_url"]
     model = cfg.get("model", "openai/gpt-oss-20b")
@@ -224,7 +501,7 @@ def main() -> None:
 
     dsn = f"host={host} port={port} dbname={database} user={user} password={password}"
 
-    logger.info("Connecting to Postgres: %s:%s/%s", host, port, database)
+    LOGGER.info("Connecting to Postgres: %s:%s/%s", host, port, database)
     with psycopg.connect(dsn) as conn:
         schema_text = None
         if args.introspect:
@@ -258,7 +535,7 @@ def main() -> None:
                     timeout=120,
                 )
         except Exception as e:
-            logger.error("LLM call failed: %s", e)
+            LOGGER.error("LLM call failed: %s", e)
             print(ERROR_MESSAGE)
             return
 
@@ -1,8 +1,10 @@
 # src/text2sql_prompt.py
 from __future__ import annotations
 
+import time
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 from typing import Optional
 
@@ -52,24 +54,8 @@ class PromptBundle:
     user: str
 
 
-def build_text2sql_messages(
-    question: str,
-    *,
-    dialect: str = "postgres",
-    schema: Optional[str] = None,
-    max_limit: int = 100,
-    now_tz: str = "Asia/Tokyo",
-) -> PromptBundle:
-    """
-    Text-to-SQL 用の system/user メッセージを作る。
-    LM Studio には OpenAI互換の chat/completions と structured output を使わせる想定。
-    """
-    schema_text = schema or DEFAULT_SCHEMA
-
-    now = datetime.now(ZoneInfo(now_tz))
-    today = now.date().isoformat()
-
-    system = f"""\
+# system は dialect / max_limit / today 以外は固定なので、テンプレートを1度だけ作っておく
+_SYSTEM_TMPL = """\
 You are a careful Text-to-SQL assistant for {dialect}.
 Follow ALL rules:
 
@@ -90,11 +76,52 @@ Follow ALL rules:
 - Do not explain. The JSON will contain "sql" and optional "assumptions".
 """
 
-    user = f"""\
-[Schema]
-{schema_text}
+@lru_cache(maxsize=8)
+def _tz(name: str) -> ZoneInfo:
+    """ZoneInfo はタイムゾーン名ごとに1回だけ作る"""
+    return ZoneInfo(name)
 
-[Question]
-{question}
-"""
-    return PromptBundle(system=system, user=user)
\ No newline at end of file
+
+@lru_cache(maxsize=8)
+def _today_iso(tzname: str, bucket: int) -> str:
+    """bucket（1分単位の時刻）ごとに1回だけ日付を計算する。日付の切り替わりは最大1分遅れ"""
+    return datetime.now(_tz(tzname)).date().isoformat()
+
+
+def build_system(
+    dialect: str = "postgres",
+    max_limit: int = 100,
+    *,
+    now_tz: str = "Asia/Tokyo",
+) -> str:
+    """
+    system メッセージだけを作る（質問に依存しないので評価ループ外で1回だけ作れる）。
+    スキーマは user 側に入るので build_user に渡す。
+    """
+    today = _today_iso(now_tz, int(time.time()) // 60)
+    return _SYSTEM_TMPL.format_map({"dialect": dialect, "max_limit": max_limit, "today": today})
+
+
+def build_user(question: str, schema: Optional[str] = None) -> str:
+    """
+    user メッセージ（スキーマ + 質問）を作る。
+    """
+    schema_text = schema or DEFAULT_SCHEMA
+    return "".join(("[Schema]\n", schema_text, "\n\n[Question]\n", question, "\n"))
+
+
+def build_text2sql_messages(
+    question: str,
+    *,
+    dialect: str = "postgres",
+    schema: Optional[str] = None,
+    max_limit: int = 100,
+    now_tz: str = "Asia/Tokyo",
+) -> PromptBundle:
+    """
+    Text-to-SQL 用の system/user メッセージを作る。
+    LM Studio には OpenAI互換の chat/completions と structured output を使わせる想定。
+    """
+    system = build_system(dialect, max_limit, now_tz=now_tz)
+    user = build_user(question, schema)
+    return PromptBundle(system=system, user=user)
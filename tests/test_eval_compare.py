@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import random
+from decimal import Decimal
+
+import pytest
+
+from src import eval_text2sql as ev
+
+
+def _decimal_path(expected, actual, float_round=6):
+    exp_n = ev.normalize_rows(expected, float_round=float_round, ignore_row_order=True)
+    act_n = ev.normalize_rows(actual, float_round=float_round, ignore_row_order=True)
+    return exp_n == act_n
+
+
+def _rows(n, seed, width=3):
+    rnd = random.Random(seed)
+    return [tuple(rnd.randint(-10**12, 10**12) for _ in range(width)) for _ in range(n)]
+
+
+@pytest.mark.parametrize("n", [ev._VECTORIZE_MIN_ROWS - 1, ev._VECTORIZE_MIN_ROWS, 1000])
+def test_int_rows_agree_with_decimal_path(n):
+    exp = _rows(n, 1)
+    shuffled = exp[:]
+    random.Random(2).shuffle(shuffled)
+    changed = exp[:]
+    changed[n // 2] = (changed[n // 2][0] + 1,) + changed[n // 2][1:]
+
+    for act in (shuffled, changed, _rows(n, 3)):
+        assert ev.compare_lenient(exp, act) == _decimal_path(exp, act)
+
+
+@pytest.mark.parametrize("value", [2.675, 0.1234565, 1.0000005, Decimal("2.6750000005")])
+def test_float_rows_agree_across_row_counts(value):
+    # float / Decimal は行数に関係なく同じ判定になる（NumPy の丸めを経由しない）
+    for n in (ev._VECTORIZE_MIN_ROWS - 1, ev._VECTORIZE_MIN_ROWS):
+        exp = [(i, value) for i in range(n)]
+        act = [(i, float(value)) for i in range(n)]
+        assert ev.compare_lenient(exp, act, float_round=2) == _decimal_path(exp, act, float_round=2)
+        assert ev.compare_lenient(exp, act, float_round=6) == _decimal_path(exp, act, float_round=6)
+
+
+def test_int_matrix_skips_non_int_cells():
+    assert ev._int_matrix([(1, 2), (3, 4)]) is not None
+    assert ev._int_matrix([(1, 2.0)]) is None
+    assert ev._int_matrix([(1, True)]) is None
+    assert ev._int_matrix([(1, None)]) is None
+    assert ev._int_matrix([(1, Decimal(2))]) is None
+    assert ev._int_matrix([(2**70,)]) is None
+
+
+def test_int_and_decimal_mix_falls_back_to_decimal_path():
+    n = ev._VECTORIZE_MIN_ROWS
+    exp = [(i,) for i in range(n)]
+    act = [(Decimal(i),) for i in range(n)]
+    assert ev.compare_lenient(exp, act) is True
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import pytest
+
+from src import run_text2sql as rt
+
+MAX_LIMIT = 100
+
+
+def _outcome(fn, sql):
+    try:
+        return fn(sql)
+    except ValueError as e:
+        return ("error", type(e))
+
+
+def _token_path(sql):
+    rt._guard_sql_cached.cache_clear()
+    return rt.guard_sql(sql, max_limit=MAX_LIMIT)
+
+
+def _parse_path(sql):
+    return rt._guard_with_parse(sql.strip(), "postgres", MAX_LIMIT)
+
+
+CASES = [
+    # LIMIT の有無・上限
+    "select a from t",
+    "select a from t limit 50",
+    "select a from t limit 500",
+    "SELECT a FROM t limit   500",
+    "select a from t limit 500 offset 10",
+    "select a from t limit all",
+    "select a from t;",
+    "select a from t limit 5000;",
+    # コメント
+    "select a from t -- note",
+    "select a -- limit 5\nfrom t",
+    "select a /* limit 900 */ from t limit 900",
+    "select a from t limit /* n */ 900",
+    # 入れ子の LIMIT
+    "select a from (select b from t limit 5) x",
+    "select a from (select b from t limit 500) x limit 1000",
+    "select a from t where b in (select b from u limit 900)",
+    # 集合演算
+    "select a from t union select a from u",
+    "select a from t where b in (select b from u union select b from v) limit 900",
+    # FETCH FIRST
+    "select a from t fetch first 500 rows only",
+    "select a from t order by a fetch first 5 rows only",
+    # CTE
+    "with x as (select 1 as a limit 500) select * from x",
+    "with x as (select 1 as a) select * from x limit 900",
+    "with x as (select 1 as a), y as (select a from x limit 3) select * from y",
+    # 括弧始まり・SELECT 以外
+    "(select 1)",
+    "values (1)",
+    # 壊れた SQL
+    "select 1 +",
+    "select * from t where",
+    "select a from t limit",
+    "select a from t order by",
+    "select (a from t",
+    "select a from t)",
+]
+
+
+@pytest.mark.parametrize("sql", CASES)
+def test_token_path_matches_parse_path(sql):
+    assert _outcome(_token_path, sql) == _outcome(_parse_path, sql)
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("select a from t limit 500", "select a from t LIMIT 100"),
+        ("SELECT a FROM t limit   500", "SELECT a FROM t LIMIT 100"),
+        ("select a from t", "select a from t LIMIT 100"),
+        ("select a from t;", "select a from t LIMIT 100"),
+        ("select a from t -- note", "select a from t LIMIT 100 -- note"),
+        ("select a from t limit 50", "select a from t limit 50"),
+        (
+            "select a from (select b from t limit 500) x limit 1000",
+            "select a from (select b from t limit 500) x LIMIT 100",
+        ),
+        ("select a from t fetch first 500 rows only", "select a from t fetch first 500 rows only"),
+    ],
+)
+def test_limit_rewrite(sql, expected):
+    assert _token_path(sql) == expected
+
+
+@pytest.mark.parametrize("sql", ["select 1 +", "select * from t where", "select a from t limit", "(select 1)"])
+def test_rejects_what_sqlglot_rejects(sql):
+    with pytest.raises(ValueError):
+        _token_path(sql)
+
+
+@pytest.mark.parametrize("sql", ["delete from t", "select 1; select 2", "select a from t cross join u", ""])
+def test_forbidden_and_empty(sql):
+    with pytest.raises(ValueError):
+        rt.guard_sql(sql)
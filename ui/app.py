@@ -1,18 +1,28 @@
 # app.py
 from __future__ import annotations
 
+import hashlib
 import json
 import os
+import queue
 import re
-from dataclasses import dataclass
+import threading
+import uuid
+from dataclasses import dataclass, field
 from decimal import Decimal, InvalidOperation
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+import orjson
 import pandas as pd
 import psycopg
+import pyarrow as pa
 import requests
 import streamlit as st
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from psycopg_pool import ConnectionPool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from vector_search.indexer import build_index
 from vector_search.retriever import retrieve
@@ -58,6 +68,15 @@ def get_dsn(cfg: Dict[str, Any]) -> str:
     return f"host={host} port={port} dbname={database} user={user} password={password}"
 
 
+@st.cache_resource(show_spinner=False)
+def get_pool(dsn: str) -> ConnectionPool:
+    """
+    DSN ごとに1つのコネクションプールをプロセス内で共有する（ターンごとの接続確立を省く）。
+    読み取り専用の用途なので autocommit にして BEGIN/COMMIT の往復も省く。
+    """
+    return ConnectionPool(dsn, min_size=2, max_size=10, kwargs={"autocommit": True}, open=True)
+
+
 # -------------------------
 # Data model (history)
 # -------------------------
@@ -67,8 +86,9 @@ class UiTurn:
     summary: Optional[str] = None
     sql: Optional[str] = None
     cols: Optional[List[str]] = None
-    rows: Optional[List[List[Any]]] = None
+    table: Optional[pa.Table] = None
     error: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
 
 
 @dataclass
@@ -77,49 +97,72 @@ class VectorTurn:
     results: Optional[List[Dict[str, Any]]] = None
     sql: Optional[str] = None
     cols: Optional[List[str]] = None
-    rows: Optional[List[List[Any]]] = None
+    table: Optional[pa.Table] = None
     error: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
 
 
 # -------------------------
 # DB schema summary
 # -------------------------
 def fetch_schema_summary(conn: psycopg.Connection, max_tables: int = 80) -> str:
-    q_tables = """
-    SELECT table_schema, table_name
-    FROM information_schema.tables
-    WHERE table_schema NOT IN ('pg_catalog','information_schema')
-      AND table_type='BASE TABLE'
-    ORDER BY table_schema, table_name
-    LIMIT %s;
-    """
-    q_cols = """
-    SELECT column_name, data_type
-    FROM information_schema.columns
-    WHERE table_schema=%s AND table_name=%s
-    ORDER BY ordinal_position;
+    # テーブル一覧とカラムを1クエリで取る（テーブルごとの往復をなくす）
+    q = """
+    WITH t AS (
+        SELECT table_schema, table_name
+        FROM information_schema.tables
+        WHERE table_schema NOT IN ('pg_catalog','information_schema')
+          AND table_type='BASE TABLE'
+        ORDER BY table_schema, table_name
+        LIMIT %s
+    )
+    SELECT t.table_schema, t.table_name, c.column_name, c.data_type
+    FROM t
+    LEFT JOIN information_schema.columns c
+      ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+    ORDER BY t.table_schema, t.table_name, c.ordinal_position;
     """
     out: List[str] = []
+    prev: Optional[Tuple[str, str]] = None
     with conn.cursor() as cur:
-        cur.execute(q_tables, (max_tables,))
-        tables = cur.fetchall()
-        for schema, table in tables:
-            out.append(f"- {schema}.{table}")
-            cur.execute(q_cols, (schema, table))
-            cols = cur.fetchall()
-            for col_name, data_type in cols:
+        cur.execute(q, (max_tables,))
+        for schema, table, col_name, data_type in cur.fetchall():
+            if (schema, table) != prev:
+                out.append(f"- {schema}.{table}")
+                prev = (schema, table)
+            if col_name is not None:
                 out.append(f"  - {col_name}: {data_type}")
     return "\n".join(out)
 
 
-def run_query(conn: psycopg.Connection, sql: str, max_rows: int = 300) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_schema(dsn: str, max_tables: int = 80) -> str:
+    """スキーマ要約は DSN ごとにプロセス内で共有（リラン・他ユーザーでも再取得しない）"""
+    with get_pool(dsn).connection() as conn:
+        return fetch_schema_summary(conn, max_tables)
+
+
+def _to_arrow_column(values: Tuple[Any, ...]) -> pa.Array:
+    try:
+        return pa.array(values)
+    except (pa.ArrowException, TypeError, ValueError, OverflowError):
+        # 型が混在する列などは表示用に文字列へ落とす
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def run_query(conn: psycopg.Connection, sql: str, max_rows: int = 300) -> pa.Table:
+    """
+    結果を列指向の Arrow Table で返す（tuple → list → DataFrame の多重コピーをしない）。
+    DataFrame が要るところで table.to_pandas() する。
+    """
     with conn.cursor() as cur:
         cur.execute(sql)
         if cur.description is None:
-            return [], []
+            return pa.table({})
         cols = [d.name for d in cur.description]
         rows = cur.fetchmany(max_rows)
-        return cols, rows
+    columns = list(zip(*rows)) if rows else [() for _ in cols]
+    return pa.Table.from_arrays([_to_arrow_column(c) for c in columns], names=cols)
 
 
 # -------------------------
@@ -134,30 +177,41 @@ FORBIDDEN_PATTERNS = [
     r"\bcross\s+join\b",
 ]
 
+# 毎回の re キャッシュ引きを避けるため、モジュール読み込み時に1度だけコンパイル
+# 禁止パターンは1本の選択（名前付きグループ）にまとめて、SQL を1回だけ走査する
+_FORBIDDEN_ALL = re.compile(
+    "|".join(f"(?P<p{i}>{p})" for i, p in enumerate(FORBIDDEN_PATTERNS)),
+    re.IGNORECASE,
+)
+_LIMIT_RE = re.compile(r"\blimit\s+(\d+)\b", re.IGNORECASE)
+_LIMIT_SUB = re.compile(r"\blimit\s+\d+\b", re.IGNORECASE)
+
 
 def guard_sql(sql: str, max_limit: int = 100) -> str:
     s = (sql or "").strip()
     if not s:
         raise ValueError("SQLが空です")
 
-    # \n が文字として混ざる問題を潰す
-    s = s.replace("\\n", "\n").replace("\\t", "\t").replace("\\r", "\r").strip()
+    # \n が文字として混ざる問題を潰す（バックスラッシュが無ければコピーしない）
+    if "\\" in s:
+        s = s.replace("\\n", "\n").replace("\\t", "\t").replace("\\r", "\r").strip()
 
-    head = s.lstrip().lower()
-    if not (head.startswith("select") or head.startswith("with")):
+    # s は strip 済みなので先頭6文字だけ小文字化して見る（全文の lower() コピーを作らない）
+    head = s[:6].lower()
+    if not (head == "select" or head.startswith("with")):
         raise ValueError("SELECT/WITH以外のSQLは拒否します")
 
-    low = s.lower()
-    for pat in FORBIDDEN_PATTERNS:
-        if re.search(pat, low, flags=re.IGNORECASE):
-            raise ValueError(f"危険なSQLパターンを検出したため拒否しました: {pat}")
+    m = _FORBIDDEN_ALL.search(s)
+    if m:
+        pat = FORBIDDEN_PATTERNS[int(m.lastgroup[1:])]
+        raise ValueError(f"危険なSQLパターンを検出したため拒否しました: {pat}")
 
     # LIMITの付与/丸め
-    m = re.search(r"\blimit\s+(\d+)\b", low)
+    m = _LIMIT_RE.search(s)
     if m:
         lim = int(m.group(1))
         if lim > max_limit:
-            s = re.sub(r"\blimit\s+\d+\b", f"LIMIT {max_limit}", s, flags=re.IGNORECASE)
+            s = _LIMIT_SUB.sub(f"LIMIT {max_limit}", s)
     else:
         s = s.rstrip().rstrip(";") + f" LIMIT {max_limit}"
 
@@ -167,12 +221,55 @@ def guard_sql(sql: str, max_limit: int = 100) -> str:
 # -------------------------
 # LLM calls: LM Studio / Groq
 # -------------------------
-def lmstudio_chat(cfg: Dict[str, Any], messages: List[Dict[str, str]], temperature: float = 0.1) -> str:
+# LM Studio(http) / Groq(https) への接続は keep-alive で使い回す
+# POST は既定ではリトライ対象外なので allowed_methods で明示する
+# 再送するのは接続できなかったとき（未送信）と 429/5xx の応答だけ。送信後の読み取りエラーは二重実行を避けて再送しない
+_RETRY = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    status=2,
+    other=0,
+    backoff_factor=0.2,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods=frozenset({"POST"}),
+    raise_on_status=False,
+)
+_SESSION = requests.Session()
+_SESSION.headers.update({"Connection": "keep-alive", "Content-Type": "application/json"})
+_SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=_RETRY))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=_RETRY))
+
+# 同じ (provider, model, temperature, messages) の応答は一定時間使い回す（プリセット質問の再実行など）
+# Streamlit はセッションごとにスレッドが分かれるのでロックで守る
+_CHAT_CACHE: TTLCache = TTLCache(maxsize=512, ttl=600)
+_CHAT_CACHE_LOCK = threading.Lock()
+
+
+def _chat_cache_key(provider: str, model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+    raw = orjson.dumps({"p": provider, "m": model, "t": temperature, "msgs": messages}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _chat_cache_get(key: str) -> Optional[str]:
+    with _CHAT_CACHE_LOCK:
+        return _CHAT_CACHE.get(key)
+
+
+def _chat_cache_put(key: str, content: str) -> None:
+    with _CHAT_CACHE_LOCK:
+        _CHAT_CACHE[key] = content
+
+
+def _lmstudio_request(
+    cfg: Dict[str, Any], messages: List[Dict[str, str]], temperature: float
+) -> Tuple[str, str, Dict[str, Any]]:
     url = cfg.get("api_url")
     model = cfg.get("model")
     if not url or not model:
         raise RuntimeError("setting.json の api_url / model が未設定です")
 
+    key = _chat_cache_key("lmstudio", model, temperature, messages)
     payload = {
         "model": model,
         "messages": messages,
@@ -180,46 +277,158 @@ def lmstudio_chat(cfg: Dict[str, Any], messages: List[Dict[str, str]], temperatu
         "top_p": 0.95,
         # response_format は送らない（LM Studio制約回避）
     }
-    r = requests.post(url, json=payload, timeout=120)
-    if r.status_code != 200:
-        raise RuntimeError(f"LM Studio returned {r.status_code}: {r.text[:500]}")
-    data = r.json()
-    return data["choices"][0]["message"]["content"]
+    return key, url, payload
 
 
-def groq_chat(messages: List[Dict[str, str]], temperature: float = 0.1) -> str:
+def _groq_request(
+    messages: List[Dict[str, str]], temperature: float
+) -> Tuple[str, str, Dict[str, Any], Dict[str, str]]:
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise RuntimeError("GROQ_API_KEY が .env にありません")
     url = "https://api.groq.com/openai/v1/chat/completions"
 
     model = os.getenv("DEFAULT_GROQ_MODEL", "llama-3.3-70b-versatile")
+    key = _chat_cache_key("groq", model, temperature, messages)
     payload = {"model": model, "messages": messages, "temperature": temperature, "top_p": 0.95}
     headers = {"Authorization": f"Bearer {api_key}"}
+    return key, url, payload, headers
+
 
-    r = requests.post(url, json=payload, headers=headers, timeout=60)
+def lmstudio_chat(cfg: Dict[str, Any], messages: List[Dict[str, str]], temperature: float = 0.1) -> str:
+    key, url, payload = _lmstudio_request(cfg, messages, temperature)
+    cached = _chat_cache_get(key)
+    if cached is not None:
+        return cached
+
+    # 送受信とも orjson（bytes のまま渡す/読む）
+    r = _SESSION.post(url, data=orjson.dumps(payload), timeout=120)
+    if r.status_code != 200:
+        raise RuntimeError(f"LM Studio returned {r.status_code}: {r.text[:500]}")
+    data = orjson.loads(r.content)
+    content = data["choices"][0]["message"]["content"]
+    _chat_cache_put(key, content)
+    return content
+
+
+def groq_chat(messages: List[Dict[str, str]], temperature: float = 0.1) -> str:
+    key, url, payload, headers = _groq_request(messages, temperature)
+    cached = _chat_cache_get(key)
+    if cached is not None:
+        return cached
+
+    r = _SESSION.post(url, data=orjson.dumps(payload), headers=headers, timeout=60)
     if r.status_code != 200:
         raise RuntimeError(f"Groq returned {r.status_code}: {r.text[:500]}")
-    data = r.json()
-    return data["choices"][0]["message"]["content"]
+    data = orjson.loads(r.content)
+    content = data["choices"][0]["message"]["content"]
+    _chat_cache_put(key, content)
+    return content
+
+
+def _iter_sse_content(r: requests.Response) -> Iterator[Optional[str]]:
+    """
+    OpenAI 互換の SSE（data: {...} 行）から choices[0].delta.content を順に取り出す。
+    [DONE] まで届いたら最後に None を1回だけ返す（途中で切れたストリームと区別するため）
+    """
+    for line in r.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            yield None
+            return
+        try:
+            chunk = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            continue
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        piece = (choices[0].get("delta") or {}).get("content")
+        if piece:
+            yield piece
+
+
+def _stream_chat(
+    label: str,
+    key: str,
+    url: str,
+    payload: Dict[str, Any],
+    *,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: int,
+) -> Iterator[str]:
+    """
+    stream=true で投げてトークンを届いた順に yield する。
+    キャッシュ済みなら1回で全文を返す。キャッシュに入れるのは [DONE] まで受け取れて中身があったときだけ
+    （接続が途中で切れた・呼び出し側が読むのをやめた応答は入れない）。
+    """
+    cached = _chat_cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts: List[str] = []
+    done = False
+    body = orjson.dumps({**payload, "stream": True})
+    with _SESSION.post(url, data=body, headers=headers, timeout=timeout, stream=True) as r:
+        if r.status_code != 200:
+            raise RuntimeError(f"{label} returned {r.status_code}: {r.text[:500]}")
+        # text/event-stream は charset が付かないことがあり、requests の既定 ISO-8859-1 だと日本語が化ける
+        r.encoding = "utf-8"
+        for piece in _iter_sse_content(r):
+            if piece is None:
+                done = True
+                continue
+            parts.append(piece)
+            yield piece
+    content = "".join(parts)
+    if done and content.strip():
+        _chat_cache_put(key, content)
+
+
+def lmstudio_chat_stream(
+    cfg: Dict[str, Any], messages: List[Dict[str, str]], temperature: float = 0.1
+) -> Iterator[str]:
+    key, url, payload = _lmstudio_request(cfg, messages, temperature)
+    yield from _stream_chat("LM Studio", key, url, payload, timeout=120)
+
+
+def groq_chat_stream(messages: List[Dict[str, str]], temperature: float = 0.1) -> Iterator[str]:
+    key, url, payload, headers = _groq_request(messages, temperature)
+    yield from _stream_chat("Groq", key, url, payload, headers=headers, timeout=60)
+
+
+_SQL_FENCE_RE = re.compile(r"```sql\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+_SQL_HEAD_RE = re.compile(r"\b(with|select)\b.*", re.DOTALL | re.IGNORECASE)
 
 
 def extract_sql_from_text(text: str) -> str:
+    # 先頭の1文字で形を見分ける（JSON / ```sql / 生SQL）。正規表現の全文走査は最後の手段
+    s = text.lstrip()
+    head = s[:1]
+
     # 1) JSONが返ってきたら {sql: "..."} を拾う
-    try:
-        obj = json.loads(text)
-        if isinstance(obj, dict) and "sql" in obj and isinstance(obj["sql"], str):
-            return obj["sql"].strip()
-    except Exception:
-        pass
+    if head == "{":
+        try:
+            obj = orjson.loads(s)
+            if isinstance(obj, dict) and "sql" in obj and isinstance(obj["sql"], str):
+                return obj["sql"].strip()
+        except orjson.JSONDecodeError:
+            pass
 
     # 2) ```sql ... ``` を優先
-    m = re.search(r"```sql\s*(.*?)\s*```", text, flags=re.DOTALL | re.IGNORECASE)
+    if head == "`" and s[:6].lower() == "```sql":
+        end = s.find("```", 6)
+        if end != -1:
+            return s[6:end].strip()
+    m = _SQL_FENCE_RE.search(text)
     if m:
         return m.group(1).strip()
 
     # 3) 最初の SELECT/WITH から最後まで（余計な説明がある場合は;で切る）
-    m = re.search(r"\b(with|select)\b.*", text, flags=re.DOTALL | re.IGNORECASE)
+    m = _SQL_HEAD_RE.match(s) or _SQL_HEAD_RE.search(text)
     if m:
         sql = m.group(0).strip()
         if ";" in sql:
@@ -229,22 +438,18 @@ def extract_sql_from_text(text: str) -> str:
     raise RuntimeError("LLMの応答からSQLを抽出できませんでした")
 
 
-def build_text2sql_prompt(schema_text: Optional[str], question: str) -> Tuple[str, str]:
-    """
-    system / user を返す
-    """
-    schema_part = schema_text or "(schema unavailable)"
-    system = (
-        "あなたはPostgreSQLのSQLエキスパートです。"
-        "ユーザーの質問に対して、安全なSELECT/CTE（WITH）のみを生成してください。"
-        "INSERT/UPDATE/DELETE/DDLは禁止です。"
-        "必ず実行可能なSQLだけを返してください。余計な説明は禁止です。"
-    )
-
-    user = f"""以下のDBスキーマを参照してSQLを1つだけ作ってください。
+# system は固定、user もスキーマと質問以外は固定なので文字列を1度だけ作っておく
+_UI_SYSTEM_PROMPT = (
+    "あなたはPostgreSQLのSQLエキスパートです。"
+    "ユーザーの質問に対して、安全なSELECT/CTE（WITH）のみを生成してください。"
+    "INSERT/UPDATE/DELETE/DDLは禁止です。"
+    "必ず実行可能なSQLだけを返してください。余計な説明は禁止です。"
+)
+_UI_USER_HEAD = """以下のDBスキーマを参照してSQLを1つだけ作ってください。
 
 [Schema]
-{schema_part}
+"""
+_UI_USER_MID = """
 
 [Rules]
 - 返すのはSQLのみ（説明文なし）
@@ -253,9 +458,16 @@ def build_text2sql_prompt(schema_text: Optional[str], question: str) -> Tuple[st
 - 取りすぎないように LIMIT 100 を付ける（無ければ後で付ける）
 
 [Question]
-{question}
 """
-    return system, user
+
+
+def build_text2sql_prompt(schema_text: Optional[str], question: str) -> Tuple[str, str]:
+    """
+    system / user を返す
+    """
+    schema_part = schema_text or "(schema unavailable)"
+    user = "".join((_UI_USER_HEAD, schema_part, _UI_USER_MID, question, "\n"))
+    return _UI_SYSTEM_PROMPT, user
 
 
 def call_text2sql(
@@ -279,10 +491,10 @@ def call_text2sql(
     return extract_sql_from_text(out)
 
 
-def call_summary(provider: str, cfg: Dict[str, Any], question: str, sql: str, df: pd.DataFrame) -> str:
-    # 結果を縮める
-    head = df.head(15).to_dict(orient="records")
-    profile = {"rows": int(df.shape[0]), "cols": list(df.columns)}
+def _summary_messages(question: str, sql: str, table: pa.Table) -> List[Dict[str, str]]:
+    # 結果を縮める（DataFrame にするのは先頭の15行だけ）
+    head = table.slice(0, 15).to_pandas().to_dict(orient="records")
+    profile = {"rows": int(table.num_rows), "cols": list(table.column_names)}
 
     prompt = f"""あなたはデータ分析アシスタントです。
 次の「質問」「SQL」「結果」をもとに、日本語で短い要約（3〜6行）を書いてください。
@@ -297,21 +509,71 @@ def call_summary(provider: str, cfg: Dict[str, Any], question: str, sql: str, df
 {sql}
 
 [結果概要]
-{json.dumps(profile, ensure_ascii=False, default=str)}
+{orjson.dumps(profile, default=str).decode()}
 
 [結果サンプル]
-{json.dumps(head, ensure_ascii=False, default=str)}
+{orjson.dumps(head, default=str).decode()}
 """
 
-    msgs = [{"role": "user", "content": prompt}]
+    return [{"role": "user", "content": prompt}]
+
+
+def call_summary(provider: str, cfg: Dict[str, Any], question: str, sql: str, table: pa.Table) -> str:
+    msgs = _summary_messages(question, sql, table)
     if provider == "groq":
         return groq_chat(msgs, temperature=0.3)
     return lmstudio_chat(cfg, msgs, temperature=0.3)
 
 
+def call_summary_stream(
+    provider: str, cfg: Dict[str, Any], question: str, sql: str, table: pa.Table
+) -> Iterator[str]:
+    """call_summary のストリーミング版（st.write_stream にそのまま渡す）"""
+    msgs = _summary_messages(question, sql, table)
+    if provider == "groq":
+        return groq_chat_stream(msgs, temperature=0.3)
+    return lmstudio_chat_stream(cfg, msgs, temperature=0.3)
+
+
+def prefetch_stream(it: Iterator[str]) -> Iterator[str]:
+    """
+    別スレッドで it を先に読み進め、受け取った分から順に返すイテレータを返す。
+    スレッド側は LLM の受信だけを行い、st.* は呼ばない（描画はスクリプトスレッドのまま）。
+    asyncio.create_task にしないのは、render_result が同期の st.* 呼び出しでイベントループに制御を返さず、
+    タスクが描画の後まで進まないため（重ねたいのはまさにその描画時間）。
+    """
+    q: "queue.Queue[Any]" = queue.Queue()
+    done = object()
+
+    def pump() -> None:
+        try:
+            for piece in it:
+                q.put(piece)
+        except Exception as e:
+            q.put(e)
+        finally:
+            q.put(done)
+
+    threading.Thread(target=pump, daemon=True).start()
+
+    def drain() -> Iterator[str]:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    return drain()
+
+
 # -------------------------
 # Visualization
 # -------------------------
+_DATE_PREFIX_RE = re.compile(r"\d{4}[-/]\d{1,2}[-/]\d{1,2}")
+
+
 def render_result(df: pd.DataFrame) -> None:
     if df is None or df.empty:
         st.info("結果が0件でした")
@@ -322,39 +584,43 @@ def render_result(df: pd.DataFrame) -> None:
         st.metric(label=str(df.columns[0]), value=str(df.iloc[0, 0]))
         return
 
+    # 列の型は1回だけ引いて、以降はこの dict で判定する
+    dtypes = df.dtypes.to_dict()
+    obj_cols = [c for c, d in dtypes.items() if d == object]
+
     # 2) 一覧系は表（id + created_at など）
     id_like = {"customer_id", "product_id", "order_id", "order_item_id"}
-    has_id = any(c in df.columns for c in id_like)
-    has_created = any(c in df.columns for c in ["created_at", "updated_at"])
+    has_id = any(c in dtypes for c in id_like)
+    has_created = any(c in dtypes for c in ["created_at", "updated_at"])
     if has_id and has_created:
         st.dataframe(df, use_container_width=True)
         return
 
-    obj_cols = [c for c in df.columns if df[c].dtype == object]
     if len(obj_cols) >= 2 and df.shape[1] >= 3:
         st.dataframe(df, use_container_width=True)
         return
 
     # 3) 時系列: datetime列 + 数値列
-    dt_col: Optional[str] = None
-    for c in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[c]):
-            dt_col = c
-            break
+    dt_col: Optional[str] = next((c for c, d in dtypes.items() if pd.api.types.is_datetime64_any_dtype(d)), None)
 
     if dt_col is None:
-        for c in df.columns:
-            if df[c].dtype == object:
-                try:
-                    tmp = pd.to_datetime(df[c], errors="raise")
-                    df = df.copy()
-                    df[c] = tmp
-                    dt_col = c
-                    break
-                except Exception:
-                    pass
+        for c in obj_cols:
+            # 先頭の非NULL値が日付っぽい列だけ変換を試す（全 object 列で to_datetime しない）
+            first = df[c].first_valid_index()
+            if first is None or not _DATE_PREFIX_RE.match(str(df[c].at[first])):
+                continue
+            try:
+                tmp = pd.to_datetime(df[c], errors="raise")
+                df = df.copy()
+                df[c] = tmp
+                dtypes[c] = tmp.dtype
+                obj_cols.remove(c)
+                dt_col = c
+                break
+            except Exception:
+                pass
 
-    num_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    num_cols = [c for c, d in dtypes.items() if pd.api.types.is_numeric_dtype(d)]
 
     if dt_col and num_cols:
         df2 = df[[dt_col] + num_cols].dropna(subset=[dt_col]).sort_values(dt_col)
@@ -365,13 +631,11 @@ def render_result(df: pd.DataFrame) -> None:
     # 4) カテゴリ + 数値: 棒（上位20）
     if len(df.columns) >= 2:
         # 数値列
-        num_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
         if not num_cols:
             st.dataframe(df, use_container_width=True)
             return
 
         # ★IDっぽい列はY候補から除外（customer_id, product_id, ...）
-        id_like = {"customer_id", "product_id", "order_id", "order_item_id"}
         y_candidates = [c for c in num_cols if c not in id_like and not c.lower().endswith("_id")]
 
         # ★指標っぽい列名を優先（count/sales/total/qty/amount/rate）
@@ -391,7 +655,7 @@ def render_result(df: pd.DataFrame) -> None:
             y_col = num_cols[0]
 
         # ★X（カテゴリ）は文字列優先、無ければID列を使う
-        cat_col = next((c for c in df.columns if df[c].dtype == object), None)
+        cat_col = obj_cols[0] if obj_cols else None
         if cat_col is None:
             # ID列があればそれをXに
             cat_col = next((c for c in df.columns if c in id_like or c.lower().endswith("_id")), df.columns[0])
@@ -408,6 +672,15 @@ def render_result(df: pd.DataFrame) -> None:
         return
 
 
+@st.cache_data(show_spinner=False, max_entries=64)
+def render_turn_result(turn_id: str, _table: pa.Table) -> None:
+    """
+    ターンごとの描画結果をキャッシュする（リランでは要素をリプレイするだけで render_result を再実行しない）。
+    キーは turn_id のみ（_table はハッシュしない）。DataFrame への変換もキャッシュに外れたときだけ行う。
+    """
+    render_result(_table.to_pandas())
+
+
 # -------------------------
 # Vector search visualization
 # -------------------------
@@ -480,9 +753,9 @@ def build_ui_history_messages(turns: List[UiTurn], max_turns: int = 3) -> List[D
             parts.append(f"summary: {t.summary[:300]}")
         if t.sql:
             parts.append(f"sql: {t.sql}")
-        if t.cols is not None and t.rows is not None:
+        if t.cols is not None and t.table is not None:
             cols = ", ".join(t.cols[:6])
-            parts.append(f"result: rows={len(t.rows)} cols={cols}")
+            parts.append(f"result: rows={t.table.num_rows} cols={cols}")
         if t.error:
             parts.append(f"error: {t.error}")
         if not parts:
@@ -501,9 +774,9 @@ def build_vector_history_messages(turns: List[VectorTurn], max_turns: int = 3) -
             parts.append(f"sources: {', '.join(sources)}")
         if t.sql:
             parts.append(f"sql: {t.sql}")
-        if t.cols is not None and t.rows is not None:
+        if t.cols is not None and t.table is not None:
             cols = ", ".join(t.cols[:6])
-            parts.append(f"result: rows={len(t.rows)} cols={cols}")
+            parts.append(f"result: rows={t.table.num_rows} cols={cols}")
         if t.error:
             parts.append(f"error: {t.error}")
         if not parts:
@@ -561,8 +834,9 @@ def main() -> None:
             st.caption("Uses embeddings_url / embeddings_model from setting.json")
             if st.button("Build / Reset Vector Index", use_container_width=True):
                 try:
+                    # 索引の作り直しは store 側が自分で commit する前提（autocommit だと insert が1行ずつ確定する）ので、プールは使わない
                     with psycopg.connect(dsn) as conn:
-                        count = build_index(conn, cfg, reset=True)
+                        count = build_index(conn, cfg, reset=True, dsn=dsn)
                     st.success(f"Indexed {count} documents.")
                 except Exception as e:
                     st.error(str(e))
@@ -578,9 +852,8 @@ def main() -> None:
                     render_vector_results(t.results)
                 if t.sql:
                     st.code(t.sql, language="sql")
-                if t.cols is not None and t.rows is not None:
-                    df = pd.DataFrame(t.rows, columns=t.cols)
-                    render_result(df)
+                if t.table is not None:
+                    render_turn_result(t.id, t.table)
 
         question = st.chat_input("Ask a question for vector search")
         if not question:
@@ -600,14 +873,13 @@ def main() -> None:
                 if use_hybrid:
                     if "schema_text" not in st.session_state:
                         try:
-                            with psycopg.connect(dsn) as conn:
-                                st.session_state["schema_text"] = fetch_schema_summary(conn)
+                            st.session_state["schema_text"] = cached_schema(dsn)
                         except Exception as e:
                             st.session_state["schema_text"] = None
                             st.warning(f"Schema load failed: {e}")
                     if "allowed_fields" not in st.session_state:
                         try:
-                            with psycopg.connect(dsn) as conn:
+                            with get_pool(dsn).connection() as conn:
                                 st.session_state["allowed_fields"] = fetch_allowed_fields(conn)
                         except Exception as e:
                             st.session_state["allowed_fields"] = {}
@@ -650,7 +922,7 @@ def main() -> None:
                     st.caption(f"Filters: {json.dumps(filters, ensure_ascii=True)}")
                     st.caption(f"Query: {search_query}")
 
-                with psycopg.connect(dsn) as conn:
+                with get_pool(dsn).connection() as conn:
                     results = retrieve(
                         conn,
                         cfg,
@@ -665,8 +937,7 @@ def main() -> None:
                 if run_sql_answer:
                     if "schema_text" not in st.session_state:
                         try:
-                            with psycopg.connect(dsn) as conn:
-                                st.session_state["schema_text"] = fetch_schema_summary(conn)
+                            st.session_state["schema_text"] = cached_schema(dsn)
                         except Exception as e:
                             st.session_state["schema_text"] = None
                             st.warning(f"Schema load failed: {e}")
@@ -682,13 +953,12 @@ def main() -> None:
                     )
                     sql_safe = guard_sql(sql_raw, max_limit=100)
                     turn.sql = sql_safe
-                    with psycopg.connect(dsn) as conn:
-                        cols, rows = run_query(conn, sql_safe, max_rows=300)
-                    turn.cols = cols
-                    turn.rows = [list(r) for r in rows]
-                    df = pd.DataFrame(turn.rows, columns=turn.cols)
+                    with get_pool(dsn).connection() as conn:
+                        table = run_query(conn, sql_safe, max_rows=300)
+                    turn.cols = table.column_names
+                    turn.table = table
                     st.code(sql_safe, language="sql")
-                    render_result(df)
+                    render_turn_result(turn.id, table)
             except Exception as e:
                 turn.error = str(e)
                 status.empty()
@@ -700,8 +970,7 @@ def main() -> None:
     # schema cache
     if "schema_text" not in st.session_state:
         try:
-            with psycopg.connect(dsn) as conn:
-                st.session_state["schema_text"] = fetch_schema_summary(conn)
+            st.session_state["schema_text"] = cached_schema(dsn)
         except Exception as e:
             st.session_state["schema_text"] = None
             st.warning(f"スキーマ取得に失敗（続行）: {e}")
@@ -742,9 +1011,8 @@ def main() -> None:
                 st.markdown(t.summary)
             if t.sql:
                 st.code(t.sql, language="sql")
-            if t.cols is not None and t.rows is not None:
-                df = pd.DataFrame(t.rows, columns=t.cols)
-                render_result(df)
+            if t.table is not None:
+                render_turn_result(t.id, t.table)
 
     # Input
     question = st.chat_input("質問を入力してください")
@@ -776,22 +1044,21 @@ def main() -> None:
             sql_safe = guard_sql(sql_raw, max_limit=100)
             turn.sql = sql_safe
 
-            with psycopg.connect(dsn) as conn:
-                cols, rows = run_query(conn, sql_safe, max_rows=300)
-
-            turn.cols = cols
-            turn.rows = [list(r) for r in rows]
-
-            df = pd.DataFrame(turn.rows, columns=turn.cols)
+            with get_pool(dsn).connection() as conn:
+                table = run_query(conn, sql_safe, max_rows=300)
 
-            # Summary
-            turn.summary = call_summary(provider, cfg, question, turn.sql, df)
+            turn.cols = table.column_names
+            turn.table = table
 
+            # Summary は先に裏で生成を始め、その間に SQL と結果を描画する
+            # 表示位置は従来どおり SQL/結果の上にしたいので、先に枠だけ確保しておく
+            summary_stream = prefetch_stream(call_summary_stream(provider, cfg, question, turn.sql, table))
             status.empty()
-            if turn.summary:
-                st.markdown(turn.summary)
+            summary_box = st.container()
             st.code(turn.sql, language="sql")
-            render_result(df)
+            render_turn_result(turn.id, table)
+            summary = summary_box.write_stream(summary_stream)
+            turn.summary = summary if isinstance(summary, str) else "".join(map(str, summary))
 
         except Exception as e:
             turn.error = str(e)
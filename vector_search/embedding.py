@@ -1,30 +1,155 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
 
+import httpx
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# 埋め込みAPIへの接続は keep-alive で使い回す（索引作成で何度も叩くため）
+_RETRY = Retry(
+    total=2,
+    backoff_factor=0.2,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods=frozenset({"POST"}),
+    raise_on_status=False,
+)
+_SESSION = requests.Session()
+_SESSION.headers.update({"Connection": "keep-alive", "Content-Type": "application/json"})
+_SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=_RETRY))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=_RETRY))
 
-def embed_texts(cfg: Dict[str, Any], texts: List[str], timeout: int = 60) -> List[List[float]]:
+# 非同期版（embed_texts_async）も _RETRY と同じステータス・回数・バックオフで再送する
+_RETRY_STATUSES = frozenset(_RETRY.status_forcelist)
+_MAX_RETRY_AFTER = 60.0
+
+
+def _embeddings_endpoint(cfg: Dict[str, Any]) -> Tuple[str, str]:
     url = cfg.get("embeddings_url")
     model = cfg.get("embeddings_model")
     if not url or not model:
         raise RuntimeError("setting.json is missing embeddings_url or embeddings_model")
+    return url, model
 
-    payload = {"model": model, "input": texts}
-    res = requests.post(url, json=payload, timeout=timeout)
+
+def _parse_embeddings(res: Any) -> List[List[float]]:
+    """requests / httpx の応答を受ける。本文のデコード（res.text）はエラー時だけ"""
     if res.status_code != 200:
         raise RuntimeError(f"Embeddings API returned {res.status_code}: {res.text[:500]}")
 
-    data = res.json()
-    items = data.get("data")
+    data = orjson.loads(res.content)
+    items = data.get("data") if isinstance(data, dict) else None
     if not isinstance(items, list):
         raise RuntimeError("Embeddings API response missing data[]")
 
-    out: List[List[float]] = []
+    embs: List[List[float]] = []
     for item in items:
         emb = item.get("embedding")
         if not isinstance(emb, list):
             raise RuntimeError("Embeddings API item missing embedding[]")
-        out.append([float(v) for v in emb])
-    return out
+        embs.append(emb)
+    return embs
+
+
+def _retry_after(res: httpx.Response) -> Optional[float]:
+    """Retry-After（秒数 または HTTP 日付）を秒で返す。無い・読めなければ None"""
+    value = res.headers.get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), _MAX_RETRY_AFTER)
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return min(max(0.0, when - time.time()), _MAX_RETRY_AFTER)
+
+
+async def _apost_with_retry(client: httpx.AsyncClient, url: str, body: bytes) -> httpx.Response:
+    """
+    429/5xx と接続エラーは _RETRY と同じ回数だけ再送する（同期版は _SESSION の Retry が受け持つ）。
+    待ち時間は Retry-After があればそれ、無ければ指数バックオフ。
+    """
+    headers = {"Content-Type": "application/json"}
+    for attempt in range(_RETRY.total):
+        backoff = _RETRY.backoff_factor * (2**attempt)
+        try:
+            res = await client.post(url, content=body, headers=headers)
+        except httpx.TransportError:
+            await asyncio.sleep(backoff)
+            continue
+        if res.status_code not in _RETRY_STATUSES:
+            return res
+        wait = _retry_after(res)
+        await asyncio.sleep(backoff if wait is None else wait)
+    # 最後の1回は結果も例外もそのまま返す（ステータスのエラーは _parse_embeddings が報告する）
+    return await client.post(url, content=body, headers=headers)
+
+
+def _to_array(embs: List[List[float]]) -> np.ndarray:
+    if not embs:
+        return np.empty((0, 0), dtype=np.float32)
+    if any(len(e) != len(embs[0]) for e in embs):
+        raise RuntimeError("Embeddings API returned embeddings of different dimensions")
+    return np.asarray(embs, dtype=np.float32)
+
+
+async def embed_texts_async(
+    cfg: Dict[str, Any],
+    texts: List[str],
+    *,
+    timeout: int = 60,
+    batch_size: int = 64,
+    concurrency: int = 8,
+) -> np.ndarray:
+    """
+    texts を batch_size ずつに分け、最大 concurrency 本を同時に投げる（結果は入力順のまま）。
+    索引作成のように入力が多いときに1リクエストへ全部詰めてタイムアウトするのを避ける。
+    """
+    url, model = _embeddings_endpoint(cfg)
+    chunks = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    sem = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(
+        http2=True, timeout=timeout, limits=httpx.Limits(max_connections=concurrency)
+    ) as client:
+
+        async def one(chunk: List[str]) -> List[List[float]]:
+            async with sem:
+                res = await _apost_with_retry(client, url, orjson.dumps({"model": model, "input": chunk}))
+            return _parse_embeddings(res)
+
+        parts = await asyncio.gather(*[one(c) for c in chunks])
+
+    return _to_array([e for part in parts for e in part])
+
+
+def embed_texts(
+    cfg: Dict[str, Any],
+    texts: List[str],
+    timeout: int = 60,
+    *,
+    batch_size: int = 64,
+    concurrency: int = 8,
+) -> np.ndarray:
+    """
+    埋め込みを (N, D) の float32 配列で返す（要素ごとの float() 変換をしない）。
+    1バッチに収まる件数（検索時のクエリなど）は keep-alive のセッションで1回だけ投げ、
+    それより多ければ embed_texts_async で分割・並行して投げる。
+    """
+    if len(texts) > batch_size:
+        return asyncio.run(
+            embed_texts_async(cfg, texts, timeout=timeout, batch_size=batch_size, concurrency=concurrency)
+        )
+
+    url, model = _embeddings_endpoint(cfg)
+    payload = {"model": model, "input": texts}
+    res = _SESSION.post(url, data=orjson.dumps(payload), timeout=timeout)
+    return _to_array(_parse_embeddings(res))
@@ -1,15 +1,20 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 import psycopg
 from psycopg import sql
+from psycopg_pool import ConnectionPool
 
 from vector_search.embedding import embed_texts
-from vector_search.store import ensure_vector_schema, insert_docs, reset_index
+from vector_search.store import ensure_vector_schema, insert_docs, insert_docs_parallel, reset_index
 from vector_search.types import VectorDoc
 
+# これ以上の件数なら dsn があるときに複数接続で COPY する（少量だと接続を張るコストの方が大きい）
+_PARALLEL_INSERT_MIN = 5000
+
 
 def _collect_tables(conn: psycopg.Connection, max_tables: int) -> List[Dict[str, str]]:
     q = """
@@ -25,16 +30,25 @@ def _collect_tables(conn: psycopg.Connection, max_tables: int) -> List[Dict[str,
         return [{"schema": s, "table": t} for s, t in cur.fetchall()]
 
 
-def _collect_columns(conn: psycopg.Connection, schema: str, table: str) -> List[Dict[str, str]]:
+def _collect_columns_batch(
+    conn: psycopg.Connection, tables: List[Dict[str, str]]
+) -> Dict[Tuple[str, str], List[Dict[str, str]]]:
+    """全テーブルのカラムを1クエリでまとめて取る（テーブルごとの往復をなくす）"""
     q = """
-    SELECT column_name, data_type
-    FROM information_schema.columns
-    WHERE table_schema = %s AND table_name = %s
-    ORDER BY ordinal_position
+    SELECT c.table_schema, c.table_name, c.column_name, c.data_type
+    FROM information_schema.columns c
+    JOIN unnest(%s::text[], %s::text[]) AS t(table_schema, table_name)
+      ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+    ORDER BY c.table_schema, c.table_name, c.ordinal_position
     """
+    out: Dict[Tuple[str, str], List[Dict[str, str]]] = {(t["schema"], t["table"]): [] for t in tables}
+    if not tables:
+        return out
     with conn.cursor() as cur:
-        cur.execute(q, (schema, table))
-        return [{"name": c, "type": t} for c, t in cur.fetchall()]
+        cur.execute(q, ([t["schema"] for t in tables], [t["table"] for t in tables]))
+        for s, t, c, typ in cur.fetchall():
+            out[(s, t)].append({"name": c, "type": typ})
+    return out
 
 
 def _pick_column(cols: List[Dict[str, str]], candidates: List[str]) -> Optional[Dict[str, str]]:
@@ -174,20 +188,54 @@ def _collect_snapshots(
 
 def _collect_sample_rows(
     conn: psycopg.Connection, schema: str, table: str, limit: int
-) -> List[Dict[str, Any]]:
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    サンプル行を (JSON文字列, 行dict) で返す。JSON 化は Postgres 側で行う（列順を保つため jsonb ではなく json）。
+    """
     if limit <= 0:
         return []
-    query = sql.SQL("SELECT * FROM {}.{} LIMIT %s").format(
+    query = sql.SQL("SELECT to_json(t)::text FROM {}.{} t LIMIT %s").format(
         sql.Identifier(schema), sql.Identifier(table)
     )
     with conn.cursor() as cur:
         cur.execute(query, (limit,))
         rows = cur.fetchall()
-        cols = [d.name for d in cur.description] if cur.description else []
-    out: List[Dict[str, Any]] = []
-    for row in rows:
-        out.append(dict(zip(cols, row)))
-    return out
+    # 数値は文字列のまま受け取り、Postgres の表記（1.50 など）をメタデータに残す
+    return [(text, json.loads(text, parse_int=str, parse_float=str)) for (text,) in rows]
+
+
+def _collect_table_extras(
+    conn: psycopg.Connection,
+    schema: str,
+    table: str,
+    cols: List[Dict[str, str]],
+    *,
+    sample_rows_per_table: int,
+    snapshot_months: int,
+    snapshot_max_rows: int,
+) -> List[VectorDoc]:
+    """1テーブル分のスナップショット + サンプル行（テーブル単位で独立なので並列に回せる）"""
+    docs = _collect_snapshots(
+        conn,
+        schema,
+        table,
+        cols,
+        months=snapshot_months,
+        max_rows=snapshot_max_rows,
+    )
+
+    samples = _collect_sample_rows(conn, schema, table, sample_rows_per_table)
+    for i, (row_text, row) in enumerate(samples):
+        row_meta = {k: str(v) for k, v in row.items()}
+        row_meta.update({"schema": schema, "table": table, "type": "row"})
+        docs.append(
+            VectorDoc(
+                source=f"row:{schema}.{table}#{i}",
+                text=f"ROW {schema}.{table}: {row_text}",
+                metadata=row_meta,
+            )
+        )
+    return docs
 
 
 def collect_docs(
@@ -197,13 +245,43 @@ def collect_docs(
     sample_rows_per_table: int = 3,
     snapshot_months: int = 6,
     snapshot_max_rows: int = 24,
+    dsn: Optional[str] = None,
+    workers: int = 8,
 ) -> List[VectorDoc]:
-    docs: List[VectorDoc] = []
+    """
+    dsn を渡すと、スナップショット/サンプル行の取得をコネクションプール + スレッドでテーブル並列に行う。
+    （無ければ従来どおり conn 1本で順番に取る）
+    """
     tables = _collect_tables(conn, max_tables=max_tables)
-    for item in tables:
+    columns = _collect_columns_batch(conn, tables)
+    extra_kwargs = {
+        "sample_rows_per_table": sample_rows_per_table,
+        "snapshot_months": snapshot_months,
+        "snapshot_max_rows": snapshot_max_rows,
+    }
+
+    if dsn and len(tables) > 1:
+        workers = max(1, min(workers, len(tables)))
+        with ConnectionPool(dsn, min_size=min(4, workers), max_size=workers, open=True) as pool:
+
+            def work(item: Dict[str, str]) -> List[VectorDoc]:
+                schema, table = item["schema"], item["table"]
+                with pool.connection() as c:
+                    return _collect_table_extras(c, schema, table, columns[(schema, table)], **extra_kwargs)
+
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                extras = list(ex.map(work, tables))
+    else:
+        extras = [
+            _collect_table_extras(conn, t["schema"], t["table"], columns[(t["schema"], t["table"])], **extra_kwargs)
+            for t in tables
+        ]
+
+    docs: List[VectorDoc] = []
+    for item, extra in zip(tables, extras):
         schema = item["schema"]
         table = item["table"]
-        cols = _collect_columns(conn, schema, table)
+        cols = columns[(schema, table)]
         col_desc = ", ".join(f"{c['name']} {c['type']}" for c in cols)
         text = f"TABLE {schema}.{table}: columns {col_desc}"
         docs.append(
@@ -213,30 +291,7 @@ def collect_docs(
                 metadata={"schema": schema, "table": table, "type": "table"},
             )
         )
-
-        docs.extend(
-            _collect_snapshots(
-                conn,
-                schema,
-                table,
-                cols,
-                months=snapshot_months,
-                max_rows=snapshot_max_rows,
-            )
-        )
-
-        samples = _collect_sample_rows(conn, schema, table, sample_rows_per_table)
-        for i, row in enumerate(samples):
-            row_text = json.dumps(row, ensure_ascii=True, default=str)
-            row_meta = {k: str(v) for k, v in row.items()}
-            row_meta.update({"schema": schema, "table": table, "type": "row"})
-            docs.append(
-                VectorDoc(
-                    source=f"row:{schema}.{table}#{i}",
-                    text=f"ROW {schema}.{table}: {row_text}",
-                    metadata=row_meta,
-                )
-            )
+        docs.extend(extra)
     return docs
 
 
@@ -249,6 +304,7 @@ def build_index(
     sample_rows_per_table: int = 3,
     snapshot_months: int = 6,
     snapshot_max_rows: int = 24,
+    dsn: Optional[str] = None,
 ) -> int:
     docs = collect_docs(
         conn,
@@ -256,14 +312,20 @@ def build_index(
         sample_rows_per_table=sample_rows_per_table,
         snapshot_months=snapshot_months,
         snapshot_max_rows=snapshot_max_rows,
+        dsn=dsn,
     )
     if not docs:
         return 0
 
     embeddings = embed_texts(cfg, [d.text for d in docs])
-    dim = len(embeddings[0])
-    ensure_vector_schema(conn, dim)
+    dim = int(embeddings.shape[1])
+    # "f16" なら halfvec で持つ（検索側の retrieve も同じ設定を読む）
+    precision = cfg.get("vector_precision", "f32")
+    ensure_vector_schema(conn, dim, precision=precision)
     if reset:
         reset_index(conn)
-    insert_docs(conn, docs, embeddings)
+    if dsn and len(docs) >= _PARALLEL_INSERT_MIN:
+        insert_docs_parallel(dsn, docs, embeddings, precision=precision)
+    else:
+        insert_docs(conn, docs, embeddings, precision=precision)
     return len(docs)
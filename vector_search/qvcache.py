@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+import psycopg
+
+from vector_search.store import index_generation, search
+
+
+class QVCache:
+    """
+    search の手前に置く、クエリベクトルの近さで引く結果キャッシュ。
+    言い換え程度の質問は埋め込みもほぼ同じになるので、cosine 距離が max_distance 以内で
+    (接続先, top_k, filters, min_score, precision) が一致する過去の結果があれば DB に行かずに返す。
+    「先月」と「今月」、ID や年だけ違う質問でも類似度は高く出るので、max_distance は小さめにして有効化は設定で選ぶ。
+
+    過去のクエリベクトルは正規化済み行列に持ち、内積1回で近いものを探す。行列は入った件数に合わせて倍々に伸ばす
+    （max_entries=1000, 1536次元で最大 6MB 程度）。追い出しは OrderedDict による LRU と TTL。
+    """
+
+    _INITIAL_ROWS = 64
+
+    def __init__(self, max_entries: int = 1000, max_distance: float = 0.02, ttl: float = 600.0) -> None:
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.max_entries = int(max_entries)
+        self.max_distance = float(max_distance)
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._clear_locked()
+
+    def _clear_locked(self) -> None:
+        self._mat: Optional[np.ndarray] = None
+        # slot → パラメータの hash（-1 は空き）。候補の絞り込みに使う
+        self._keys = np.empty(0, dtype=np.int64)
+        # slot → (登録時刻, パラメータ, rows)。並び順が LRU
+        self._lru: "OrderedDict[int, Tuple[float, Hashable, List[Dict[str, Any]]]]" = OrderedDict()
+        self._free: List[int] = []
+        self._used = 0
+        self._generation = index_generation()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear_locked()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def _sync_generation(self) -> None:
+        # 索引が作り直されていたら中身は全部古い
+        if self._generation != index_generation():
+            self._clear_locked()
+
+    def get(self, params: Hashable, q: np.ndarray) -> Optional[List[Dict[str, Any]]]:
+        pid = hash(params)
+        with self._lock:
+            self._sync_generation()
+            if self._mat is None or self._mat.shape[1] != q.shape[0]:
+                return None
+            cand = np.flatnonzero(self._keys[: self._used] == pid)
+            if cand.size == 0:
+                return None
+            sims = self._mat[cand] @ q
+            near = sims >= 1.0 - self.max_distance
+            cand, sims = cand[near], sims[near]
+            now = time.monotonic()
+            # 近い順に見て、期限切れは捨てながら有効でパラメータも一致する最初の1件を使う
+            for j in np.argsort(-sims, kind="stable"):
+                slot = int(cand[j])
+                ts, key, rows = self._lru[slot]
+                if now - ts > self.ttl:
+                    self._drop_locked(slot)
+                    continue
+                if key != params:
+                    continue
+                self._lru.move_to_end(slot)
+                return [dict(r) for r in rows]
+        return None
+
+    def put(self, params: Hashable, q: np.ndarray, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._sync_generation()
+            if self._mat is None or self._mat.shape[1] != q.shape[0]:
+                self._clear_locked()
+                self._mat = np.zeros((min(self._INITIAL_ROWS, self.max_entries), q.shape[0]), dtype=np.float32)
+                self._keys = np.full(self._mat.shape[0], -1, dtype=np.int64)
+            if self._free:
+                slot = self._free.pop()
+            elif self._used < self.max_entries:
+                if self._used == self._mat.shape[0]:
+                    self._grow_locked()
+                slot = self._used
+                self._used += 1
+            else:
+                slot, _ = self._lru.popitem(last=False)
+            self._mat[slot] = q
+            self._keys[slot] = hash(params)
+            self._lru[slot] = (time.monotonic(), params, [dict(r) for r in rows])
+
+    def _grow_locked(self) -> None:
+        assert self._mat is not None
+        rows = min(self._mat.shape[0] * 2, self.max_entries)
+        mat = np.zeros((rows, self._mat.shape[1]), dtype=np.float32)
+        mat[: self._mat.shape[0]] = self._mat
+        keys = np.full(rows, -1, dtype=np.int64)
+        keys[: self._keys.shape[0]] = self._keys
+        self._mat, self._keys = mat, keys
+
+    def _drop_locked(self, slot: int) -> None:
+        del self._lru[slot]
+        self._keys[slot] = -1
+        self._free.append(slot)
+
+
+def _normalize(query_emb: Iterable[float]) -> Optional[np.ndarray]:
+    q = np.asarray(query_emb, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(q))
+    if not np.isfinite(norm) or norm == 0.0:
+        return None
+    return q / norm
+
+
+def cached_search(
+    cache: QVCache,
+    conn: psycopg.Connection | None,
+    query_emb: Iterable[float],
+    top_k: int,
+    filters: Dict[str, str] | None = None,
+    min_score: float | None = None,
+    *,
+    precision: str = "f32",
+) -> List[Dict[str, Any]]:
+    """search と同じ入出力。近いクエリの結果がキャッシュにあれば DB に問い合わせない"""
+    q = _normalize(query_emb)
+    if q is None:
+        return search(conn, query_emb, top_k, filters=filters, min_score=min_score, precision=precision)
+
+    params = (
+        conn.info.dsn if conn is not None else None,
+        int(top_k),
+        tuple(sorted(filters.items())) if filters else (),
+        None if min_score is None else float(min_score),
+        precision,
+    )
+    rows = cache.get(params, q)
+    if rows is not None:
+        return rows
+    rows = search(conn, query_emb, top_k, filters=filters, min_score=min_score, precision=precision)
+    cache.put(params, q, rows)
+    return rows
@@ -1,13 +1,31 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from typing import Any, Dict, List
 
+import numpy as np
 import psycopg
 
 from vector_search.embedding import embed_texts
+from vector_search.qvcache import QVCache, cached_search
 from vector_search.store import search
 
 
+@lru_cache(maxsize=4)
+def _qv_cache(max_distance: float, max_entries: int, ttl: float) -> QVCache:
+    """近い質問の検索結果をプロセス内で使い回すキャッシュ（設定ごとに1つ。索引を作り直すと自動で捨てる）"""
+    return QVCache(max_entries=max_entries, max_distance=max_distance, ttl=ttl)
+
+
+@lru_cache(maxsize=1024)
+def _embed_one(url: str, model: str, question: str) -> np.ndarray:
+    """同じ質問の埋め込みは使い回す（プリセットの再実行などで埋め込みAPIを叩き直さない）"""
+    vec = embed_texts({"embeddings_url": url, "embeddings_model": model}, [question])[0].copy()
+    # キャッシュで共有するので書き換え不可にしておく
+    vec.setflags(write=False)
+    return vec
+
+
 def retrieve(
     conn: psycopg.Connection,
     cfg: Dict[str, Any],
@@ -19,5 +37,16 @@ def retrieve(
 ) -> List[Dict[str, Any]]:
     if top_k is None:
         top_k = int(cfg.get("rag_top_k", 4))
-    embeddings = embed_texts(cfg, [question])
-    return search(conn, embeddings[0], top_k, filters=filters, min_score=min_score)
+    query_emb = _embed_one(cfg.get("embeddings_url"), cfg.get("embeddings_model"), question)
+    precision = cfg.get("vector_precision", "f32")
+
+    # 意味の違う言い換えにも当たりうるので、qv_cache_max_distance を設定したときだけ使う
+    max_distance = cfg.get("qv_cache_max_distance")
+    if max_distance is None:
+        return search(conn, query_emb, top_k, filters=filters, min_score=min_score, precision=precision)
+    cache = _qv_cache(
+        float(max_distance),
+        int(cfg.get("qv_cache_max_entries", 1000)),
+        float(cfg.get("qv_cache_ttl", 600)),
+    )
+    return cached_search(cache, conn, query_emb, top_k, filters=filters, min_score=min_score, precision=precision)
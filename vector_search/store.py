@@ -1,20 +1,178 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Iterable, List, Tuple
+import logging
+import struct
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 
+import numpy as np
+import orjson
 import psycopg
+from psycopg.adapt import Dumper, Loader
+from psycopg.pq import Format, TransactionStatus
+from psycopg.rows import dict_row
+from psycopg.types import TypeInfo
 from psycopg.types.json import Json
 from psycopg import sql
+from psycopg_pool import ConnectionPool
 
 from vector_search.types import VectorDoc
 
+try:
+    import simsimd  # 任意依存（入っていれば search_rerank の cosine 計算に使う）
+except ImportError:
+    simsimd = None
 
-def _vector_literal(vec: Iterable[float]) -> str:
-    return "[" + ",".join(f"{v:.6f}" for v in vec) + "]"
+# vector_docs を書き換えるたびに進める世代番号（プロセス内の検索キャッシュの無効化用）
+_GENERATION = 0
+_GENERATION_LOCK = threading.Lock()
 
+# precision ごとの (embedding 列の型, binary 形式での要素の dtype)。
+# f16 は halfvec（pgvector 0.7 以降）で、テーブル・索引の容量も距離計算で読む量も半分になる
+_PRECISIONS: Dict[str, Tuple[str, str]] = {"f32": ("vector", ">f4"), "f16": ("halfvec", ">f2")}
 
-def ensure_vector_schema(conn: psycopg.Connection, dim: int) -> None:
-    with conn.cursor() as cur:
+# pgvector の HNSW 索引が扱える次元数の上限（列の型ごと）。超えると CREATE INDEX が失敗する
+_HNSW_MAX_DIM: Dict[str, int] = {"vector": 2000, "halfvec": 4000}
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _precision(precision: str) -> Tuple[str, str]:
+    try:
+        return _PRECISIONS[precision]
+    except KeyError:
+        raise ValueError(f"precision must be one of {sorted(_PRECISIONS)}, got {precision!r}") from None
+
+
+# conn を渡さずに呼んだときに使うモジュール共有のプール（configure_pool で作る）。
+# 接続を使い回すので、prepare=True の文や vector 型の登録が呼び出しをまたいで残る
+_POOL: ConnectionPool | None = None
+
+
+def configure_pool(dsn: str, *, min_size: int = 2, max_size: int = 16) -> ConnectionPool:
+    global _POOL
+    if _POOL is not None:
+        _POOL.close()
+    _POOL = ConnectionPool(dsn, min_size=min_size, max_size=max_size, open=True)
+    return _POOL
+
+
+@contextmanager
+def _get_conn() -> Iterator[psycopg.Connection]:
+    if _POOL is None:
+        raise RuntimeError("no connection given and configure_pool() has not been called")
+    with _POOL.connection() as conn:
+        yield conn
+
+
+def index_generation() -> int:
+    return _GENERATION
+
+
+def _bump_generation() -> None:
+    # insert_docs_parallel のワーカーから同時に呼ばれる（+= は不可分ではない）
+    global _GENERATION
+    with _GENERATION_LOCK:
+        _GENERATION += 1
+
+
+class _VectorBinaryDumper(Dumper):
+    """
+    pgvector の binary 入力形式: int16 次元数, int16 未使用, big-endian float4 × 次元数。
+    oid は接続ごとに _register_vector で決める。
+    クエリベクトルもこれで binary のまま送るので、テキストへの整形もサーバ側の vector 入力パースも要らない。
+    """
+
+    format = Format.BINARY
+
+    def dump(self, obj: Any) -> bytes:
+        arr = np.asarray(obj, dtype=">f4")
+        if arr.ndim != 1:
+            raise ValueError("vector must be 1-dimensional")
+        return struct.pack(">HH", arr.shape[0], 0) + arr.tobytes()
+
+
+class _VectorBinaryLoader(Loader):
+    """
+    binary で受け取った vector を float32 の ndarray にする。
+    libpq の結果バッファは結果ごとに解放されるので、view のままにはせず native endian へ1回でコピーする。
+    """
+
+    format = Format.BINARY
+    _wire = ">f4"
+    _native = np.float32
+
+    def load(self, data: Any) -> np.ndarray:
+        dim, _ = struct.unpack_from(">HH", data)
+        return np.frombuffer(data, dtype=self._wire, count=dim, offset=4).astype(self._native)
+
+
+class _HalfvecBinaryLoader(_VectorBinaryLoader):
+    """halfvec は float16 のまま返す（search_rerank の cosine を f16 のまま計算できる）"""
+
+    _wire = ">f2"
+    _native = np.float16
+
+
+def _unit_rows(arr: np.ndarray) -> np.ndarray:
+    """
+    行ごとに L2 正規化する（ノルム 0 の行はそのまま）。
+    単位ベクトル同士なら cosine 類似度 = 内積なので、検索は <#>（負の内積）で済み、距離計算ごとのノルム計算が要らない。
+    """
+    norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return arr / norms
+
+
+def _register_vector(conn: psycopg.Connection) -> None:
+    """
+    この接続で ndarray を vector 型のパラメータとして binary で送れるようにする
+    （COPY の set_types(["vector"]) もこの dumper を使う）。
+    binary loader も登録するが、効くのは binary=True のカーソルだけ（halfvec があればそれも）。
+    型情報の問い合わせは接続ごとに初回だけ。
+    """
+    if conn.adapters.types.get("vector") is not None:
+        return
+    info = TypeInfo.fetch(conn, "vector")
+    if info is None:
+        raise RuntimeError("pgvector extension is not installed (type 'vector' not found)")
+    info.register(conn)
+    dumper = type("VectorBinaryDumper", (_VectorBinaryDumper,), {"oid": info.oid})
+    conn.adapters.register_dumper(np.ndarray, dumper)
+    conn.adapters.register_loader(info.oid, _VectorBinaryLoader)
+    half = TypeInfo.fetch(conn, "halfvec")
+    if half is not None:
+        half.register(conn)
+        conn.adapters.register_loader(half.oid, _HalfvecBinaryLoader)
+
+
+def ensure_vector_schema(
+    conn: psycopg.Connection,
+    dim: int,
+    *,
+    m: int = 16,
+    ef_construction: int = 200,
+    binary: bool = False,
+    precision: str = "f32",
+) -> None:
+    """
+    binary=True で 1bit 量子化した embedding_b 列（生成列）と Hamming 距離の HNSW 索引も作る。
+    search_binary を使うときに必要（pgvector 0.7 以降）。
+    precision="f16" なら embedding を halfvec で持つ。既存テーブルの型は変えないので、切り替えるときは作り直す。
+    dim が HNSW の上限（vector 2000 / halfvec 4000）を超えるときは近傍索引を作らず、警告だけ出す。
+    """
+    col_type, _ = _precision(precision)
+    m = int(m)
+    ef_construction = int(ef_construction)
+    if m < 2 or ef_construction < 2 * m:
+        raise ValueError("hnsw requires m >= 2 and ef_construction >= 2 * m")
+
+    # DDL は pipeline でまとめて送り、文ごとの往復待ちをなくす
+    with conn.pipeline(), conn.cursor() as cur:
         cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
         cur.execute(
             f"""
@@ -23,10 +181,65 @@ def ensure_vector_schema(conn: psycopg.Connection, dim: int) -> None:
               source text NOT NULL,
               text text NOT NULL,
               metadata jsonb,
-              embedding vector({dim}) NOT NULL
+              embedding {col_type}({dim}) NOT NULL
             )
             """
         )
+        # 既存テーブルなら embedding の型が precision と合っているか（合わないと索引の演算子クラスも COPY も通らない）
+        cur.execute(
+            """
+            SELECT t.typname FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid
+            WHERE a.attrelid = 'vector_docs'::regclass AND a.attname = 'embedding'
+            """
+        )
+        row = cur.fetchone()
+    if row and row[0] != col_type:
+        conn.commit()
+        raise ValueError(f"vector_docs.embedding is {row[0]}, not {col_type}; drop vector_docs to change precision")
+
+    max_dim = _HNSW_MAX_DIM[col_type]
+    if dim > max_dim:
+        # 索引なしでも検索は全件走査で動く（索引を作っていなかった頃と同じ）ので、構築自体は止めない
+        hint = '; use precision="f16" to index up to 4000 dims' if col_type == "vector" else ""
+        _LOGGER.warning(
+            "embedding dim %d exceeds the HNSW limit %d for %s; skipping the ANN index, searches will scan all rows%s",
+            dim,
+            max_dim,
+            col_type,
+            hint,
+        )
+
+    with conn.pipeline(), conn.cursor() as cur:
+        # 近傍探索用の HNSW 索引。embedding は単位ベクトルで入れるので cosine ではなく内積（<#>）で引く。
+        # 以前の cosine 用索引は search で使われなくなるので落とす
+        cur.execute("DROP INDEX IF EXISTS vector_docs_emb_hnsw")
+        if dim <= max_dim:
+            cur.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS vector_docs_emb_ip_hnsw
+                ON vector_docs USING hnsw (embedding {col_type}_ip_ops)
+                WITH (m = {m}, ef_construction = {ef_construction})
+                """
+            )
+        # search の filters（metadata @> ...）用
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS vector_docs_meta_gin ON vector_docs USING gin (metadata jsonb_path_ops)"
+        )
+        if binary:
+            # 生成列なので insert_docs 側は変更不要（COPY した embedding からサーバ側で作られる）
+            cur.execute(
+                f"""
+                ALTER TABLE vector_docs ADD COLUMN IF NOT EXISTS embedding_b bit({dim})
+                GENERATED ALWAYS AS (binary_quantize(embedding)::bit({dim})) STORED
+                """
+            )
+            cur.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS vector_docs_emb_b_hnsw
+                ON vector_docs USING hnsw (embedding_b bit_hamming_ops)
+                WITH (m = {m}, ef_construction = {ef_construction})
+                """
+            )
     conn.commit()
 
 
@@ -34,70 +247,382 @@ def reset_index(conn: psycopg.Connection) -> None:
     with conn.cursor() as cur:
         cur.execute("TRUNCATE TABLE vector_docs")
     conn.commit()
+    _bump_generation()
 
 
-def insert_docs(conn: psycopg.Connection, docs: List[VectorDoc], embeddings: List[List[float]]) -> None:
-    if not docs:
-        return
-    if len(docs) != len(embeddings):
-        raise ValueError("docs and embeddings length mismatch")
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+_COPY_FLUSH_BYTES = 8 << 20
+
+
+def _copy_binary_chunks(docs: List[VectorDoc], embeddings: np.ndarray, elem: str = ">f4") -> Iterator[bytes]:
+    """
+    COPY ... (FORMAT BINARY) のデータをこちらで組み立て、数MBずつまとめて返す（write_row を行ごとに呼ばない）。
+    vector 列は「長さ + 次元数 + 未使用 + big-endian float4」の固定長レコードなので、全行ぶんを NumPy で1回で作る
+    （halfvec は要素が big-endian float2 になるだけで形は同じ）。
+    jsonb の binary 形式はバージョン 1 の1バイト + JSON テキスト。
+    """
+    n, dim = embeddings.shape
+    vec_rec = np.empty(n, dtype=[("len", ">i4"), ("dim", ">u2"), ("unused", ">u2"), ("v", elem, (dim,))])
+    vec_rec["len"] = 4 + np.dtype(elem).itemsize * dim
+    vec_rec["dim"] = dim
+    vec_rec["unused"] = 0
+    vec_rec["v"] = embeddings
+    vec_view = memoryview(vec_rec.tobytes())
+    rec_size = vec_rec.dtype.itemsize
+
+    pack_len = struct.Struct(">i").pack
+    row_head = struct.pack(">h", 4)
+    buf = bytearray(_COPY_SIGNATURE)
+    for i, doc in enumerate(docs):
+        source = doc.source.encode()
+        text = doc.text.encode()
+        meta = b"\x01" + orjson.dumps(doc.metadata)
+        buf += row_head
+        buf += pack_len(len(source))
+        buf += source
+        buf += pack_len(len(text))
+        buf += text
+        buf += pack_len(len(meta))
+        buf += meta
+        buf += vec_view[i * rec_size : (i + 1) * rec_size]
+        if len(buf) >= _COPY_FLUSH_BYTES:
+            yield bytes(buf)
+            buf.clear()
+    buf += _COPY_TRAILER
+    yield bytes(buf)
 
-    rows: List[Tuple[Any, ...]] = []
-    for doc, emb in zip(docs, embeddings):
-        rows.append((doc.source, doc.text, Json(doc.metadata), _vector_literal(emb)))
 
-    sql = """
-    INSERT INTO vector_docs (source, text, metadata, embedding)
-    VALUES (%s, %s, %s, %s::vector)
+def insert_docs(
+    conn: psycopg.Connection | None,
+    docs: List[VectorDoc],
+    embeddings: np.ndarray,
+    *,
+    precision: str = "f32",
+) -> None:
     """
+    embeddings は (len(docs), dim) の float32 ndarray（embed_texts の戻り値そのまま）。
+    list の list は Python float の箱を経由するので受け付けない。
+    precision は ensure_vector_schema に渡したものと揃える（COPY の binary 形式が列の型で変わる）。
+    conn が None ならモジュールのプールから借りる。
+    """
+    if conn is None:
+        with _get_conn() as c:
+            return insert_docs(c, docs, embeddings, precision=precision)
+    _, elem = _precision(precision)
+    if not isinstance(embeddings, np.ndarray) or embeddings.dtype != np.float32:
+        raise TypeError("embeddings must be a float32 numpy.ndarray")
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(docs):
+        raise ValueError("embeddings must have shape (len(docs), dim)")
+    if not docs:
+        return
+
+    copy_sql = "COPY vector_docs (source, text, metadata, embedding) FROM STDIN WITH (FORMAT BINARY)"
     with conn.cursor() as cur:
-        cur.executemany(sql, rows)
+        with cur.copy(copy_sql) as cp:
+            for chunk in _copy_binary_chunks(docs, _unit_rows(embeddings), elem):
+                cp.write(chunk)
     conn.commit()
+    _bump_generation()
+
+
+def insert_docs_parallel(
+    dsn: str,
+    docs: List[VectorDoc],
+    embeddings: np.ndarray,
+    *,
+    workers: int = 4,
+    precision: str = "f32",
+) -> None:
+    """
+    docs を workers 本の接続に分けてそれぞれ COPY する（HNSW 索引の更新がバックエンド1本の CPU で頭打ちにならない）。
+    各ワーカーは別トランザクションでコミットするので、途中で失敗すると一部だけ入った状態になる。
+    （COPY は pipeline mode では使えないので pipeline は挟まない）
+    """
+    if not isinstance(embeddings, np.ndarray) or embeddings.dtype != np.float32:
+        raise TypeError("embeddings must be a float32 numpy.ndarray")
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(docs):
+        raise ValueError("embeddings must have shape (len(docs), dim)")
+    workers = max(1, min(int(workers), len(docs)))
+    if not docs:
+        return
+
+    bounds = np.linspace(0, len(docs), workers + 1, dtype=np.int64).tolist()
+
+    def work(lo: int, hi: int) -> None:
+        with psycopg.connect(dsn) as c:
+            insert_docs(c, docs[lo:hi], embeddings[lo:hi], precision=precision)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            # list() で各ワーカーの例外をここで投げ直す
+            list(ex.map(work, bounds[:-1], bounds[1:]))
+    finally:
+        # 全ワーカーの終了後にも進める（途中のコミットの間に入ったキャッシュも捨てさせる。失敗時も一部は入っている）
+        _bump_generation()
+
+
+def _bind_filters(filters: Dict[str, str] | None, params: Dict[str, Any]) -> bool:
+    """
+    metadata の完全一致フィルタを1つの jsonb として params に積む。
+    メタデータの値はすべて文字列で入れているので、->> の比較と @> の包含は同じ結果になる。
+    """
+    if not filters:
+        return False
+    params["filt"] = Json({str(k): str(v) for k, v in filters.items()})
+    return True
+
+
+def _filter_sql(has_filters: bool) -> List[sql.Composable]:
+    where_parts: List[sql.Composable] = [sql.SQL("1=1")]
+    if has_filters:
+        # @> なら vector_docs_meta_gin が使える（キーごとの ->> 比較だと索引に乗らない）
+        where_parts.append(sql.SQL("metadata @> %(filt)s::jsonb"))
+    return where_parts
+
+
+def _query_param(precision: str) -> sql.SQL:
+    # クエリベクトルは vector で送る。halfvec 列のときは演算子と索引が halfvec 用なのでサーバ側で変換する
+    col_type, _ = _precision(precision)
+    return sql.SQL("%(q)s") if col_type == "vector" else sql.SQL(f"%(q)s::{col_type}")
+
+
+# 検索系の SQL は (フィルタの有無, min_score の有無, precision) だけで形が決まるので、組み立ては形ごとに1回だけ。
+# 文字列にして持っておけば実行ごとの sql.Composed の走査も要らない（同じ文面なら prepare 済みの文が使われる）
+@lru_cache(maxsize=8)
+def _compile_search(has_filters: bool, with_min_score: bool, precision: str = "f32") -> str:
+    # 距離は内側で d として1回だけ計算し、並べ替えと score の両方に使う。
+    # min_score は上位 k 件を取ったあとで外側で絞る（距離順なので先に絞るのと同じ結果になる）
+    # d は負の内積（単位ベクトルなので -cosine 類似度）
+    score_filter = sql.SQL("-d >= %(min_score)s") if with_min_score else sql.SQL("TRUE")
+    stmt = sql.SQL(
+        """
+        SELECT source, text, metadata, -d AS score
+        FROM (
+          SELECT source, text, metadata, embedding <#> {q} AS d
+          FROM vector_docs
+          WHERE {where_clause}
+          ORDER BY d
+          LIMIT %(k)s
+        ) AS t
+        WHERE {score_filter}
+        ORDER BY d
+        """
+    ).format(
+        where_clause=sql.SQL(" AND ").join(_filter_sql(has_filters)),
+        score_filter=score_filter,
+        q=_query_param(precision),
+    )
+    return stmt.as_string(None)
+
+
+@lru_cache(maxsize=8)
+def _compile_search_binary(has_filters: bool, with_min_score: bool, precision: str = "f32") -> str:
+    score_filter = sql.SQL("score >= %(min_score)s") if with_min_score else sql.SQL("TRUE")
+    stmt = sql.SQL(
+        """
+        SELECT source, text, metadata, score
+        FROM (
+          SELECT source, text, metadata, -(embedding <#> {q}) AS score
+          FROM (
+            SELECT source, text, metadata, embedding
+            FROM vector_docs
+            WHERE {where_clause}
+            ORDER BY embedding_b <~> binary_quantize({q})
+            LIMIT %(n)s
+          ) AS coarse
+        ) AS reranked
+        WHERE {score_filter}
+        ORDER BY score DESC
+        LIMIT %(k)s
+        """
+    ).format(
+        where_clause=sql.SQL(" AND ").join(_filter_sql(has_filters)),
+        score_filter=score_filter,
+        q=_query_param(precision),
+    )
+    return stmt.as_string(None)
+
+
+@lru_cache(maxsize=2)
+def _compile_candidates(has_filters: bool) -> str:
+    return sql.SQL("SELECT id, embedding FROM vector_docs WHERE {where_clause} LIMIT %(n)s").format(
+        where_clause=sql.SQL(" AND ").join(_filter_sql(has_filters))
+    ).as_string(None)
+
+
+@contextmanager
+def _local_ef_search(conn: psycopg.Connection, ef_search: int) -> Iterator[None]:
+    """
+    この with の中だけ hnsw.ef_search を変える（SET LOCAL 相当）。
+    conn が呼び出し側のトランザクション内なら conn.transaction() は SAVEPOINT にすぎず、
+    is_local の設定は外側のコミットまで残るので、抜けるときに元の値へ戻す（例外時は SAVEPOINT の巻き戻しで戻る）。
+    """
+    outer = conn.info.transaction_status != TransactionStatus.IDLE
+    with conn.transaction():
+        if outer:
+            prev = conn.execute("SELECT current_setting('hnsw.ef_search', true)", prepare=True).fetchone()[0]
+        conn.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),), prepare=True)
+        yield
+        if outer:
+            # prev が NULL（未設定）なら set_config は既定値に戻す
+            conn.execute("SELECT set_config('hnsw.ef_search', %s, true)", (prev,), prepare=True)
+
+
+def search_iter(
+    conn: psycopg.Connection | None,
+    query_emb: Iterable[float],
+    top_k: int,
+    filters: Dict[str, str] | None = None,
+    min_score: float | None = None,
+    *,
+    itersize: int = 256,
+    precision: str = "f32",
+) -> Iterator[Dict[str, Any]]:
+    """
+    search の結果を1件ずつ返す。top_k が itersize を超えるときはサーバ側カーソルで itersize 件ずつ取り、
+    text の長い行を全件クライアントに溜め込まない（それ以下は prepare 済みの通常カーソルで1回で取る）。
+    読み切るまでトランザクションを開いたままにするので、途中でやめるときは close() する。
+    conn が None ならモジュールのプールから借りる。
+    """
+    if conn is None:
+        with _get_conn() as c:
+            yield from search_iter(
+                c, query_emb, top_k, filters=filters, min_score=min_score, itersize=itersize, precision=precision
+            )
+        return
+
+    # クエリベクトルは名前付きプレースホルダ %(q)s を使い回す。psycopg は同名を同じ $n にまとめるので送るのは1回だけ
+    # （CTE で1回だけ持つ形だと ORDER BY が結合越しになり、ベクトル索引が使えなくなる）。
+    # 値は vector 型の binary パラメータなので ::vector のキャストも要らない
+    _register_vector(conn)
+    params: Dict[str, Any] = {"q": _unit_rows(np.asarray(query_emb, dtype=np.float32).ravel()), "k": top_k}
+    has_filters = _bind_filters(filters, params)
+    if min_score is not None:
+        params["min_score"] = float(min_score)
+    stmt = _compile_search(has_filters, min_score is not None, precision)
+
+    # ef_search は top_k に合わせて広げる（既定の 40 だと top_k が大きいとき取りこぼす）
+    ef_search = min(1000, max(40, int(top_k) * 4))
+    with _local_ef_search(conn, ef_search):
+        # score は double precision なので dict_row の行をそのまま返せる
+        if top_k > itersize:
+            with conn.cursor(name=f"vsearch_{uuid.uuid4().hex}", row_factory=dict_row) as cur:
+                cur.itersize = itersize
+                cur.execute(stmt, params)
+                yield from cur
+        else:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(stmt, params, prepare=True)
+                rows = cur.fetchall()
+            yield from rows
 
 
 def search(
-    conn: psycopg.Connection,
-    query_emb: List[float],
+    conn: psycopg.Connection | None,
+    query_emb: Iterable[float],
     top_k: int,
     filters: Dict[str, str] | None = None,
     min_score: float | None = None,
+    *,
+    precision: str = "f32",
 ) -> List[Dict[str, Any]]:
-    lit = _vector_literal(query_emb)
-    where_parts = [sql.SQL("1=1")]
-    params: List[Any] = [lit]
+    return list(search_iter(conn, query_emb, top_k, filters=filters, min_score=min_score, precision=precision))
 
-    if filters:
-        for key, value in filters.items():
-            where_parts.append(sql.SQL("metadata ->> %s = %s"))
-            params.extend([key, value])
 
+def search_binary(
+    conn: psycopg.Connection,
+    query_emb: Iterable[float],
+    top_k: int,
+    filters: Dict[str, str] | None = None,
+    min_score: float | None = None,
+    *,
+    oversample: int = 10,
+    precision: str = "f32",
+) -> List[Dict[str, Any]]:
+    """
+    search と同じ入出力。1bit 量子化列の Hamming 距離で top_k * oversample 件に粗く絞り、
+    その候補だけ元の float4 の内積（単位ベクトルなので cosine）で並べ直す（ensure_vector_schema(binary=True) が前提）。
+    """
+    _register_vector(conn)
+    params: Dict[str, Any] = {
+        "q": _unit_rows(np.asarray(query_emb, dtype=np.float32).ravel()),
+        "k": top_k,
+        "n": top_k * max(1, int(oversample)),
+    }
+    has_filters = _bind_filters(filters, params)
     if min_score is not None:
-        where_parts.append(sql.SQL("(1 - (embedding <=> %s::vector)) >= %s"))
-        params.extend([lit, float(min_score)])
+        params["min_score"] = float(min_score)
+    stmt = _compile_search_binary(has_filters, min_score is not None, precision)
 
-    params.extend([lit, top_k])
-    stmt = sql.SQL(
-        """
-        SELECT source, text, metadata, 1 - (embedding <=> %s::vector) AS score
-        FROM vector_docs
-        WHERE {where_clause}
-        ORDER BY embedding <=> %s::vector
-        LIMIT %s
-        """
-    ).format(where_clause=sql.SQL(" AND ").join(where_parts))
+    ef_search = min(1000, max(40, int(params["n"])))
+    with _local_ef_search(conn, ef_search), conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(stmt, params)
+        return cur.fetchall()
 
-    with conn.cursor() as cur:
+
+def _cosine_distances(q: np.ndarray, cand: np.ndarray) -> np.ndarray:
+    if simsimd is not None:
+        # halfvec の候補は float16 のまま渡す（simsimd は f16 のカーネルで計算する）
+        q = q.astype(cand.dtype, copy=False)
+        return np.asarray(simsimd.cdist(q[np.newaxis], cand, metric="cosine"), dtype=np.float32)[0]
+    cand = cand.astype(np.float32, copy=False)
+    norms = np.linalg.norm(cand, axis=1) * np.linalg.norm(q)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sims = (cand @ q) / norms
+    return 1.0 - np.nan_to_num(sims, nan=0.0)
+
+
+def search_rerank(
+    conn: psycopg.Connection,
+    query_emb: Iterable[float],
+    top_k: int,
+    filters: Dict[str, str] | None = None,
+    min_score: float | None = None,
+    *,
+    max_candidates: int = 5000,
+) -> List[Dict[str, Any]]:
+    """
+    search と同じ入出力。filters で候補が数千件程度に絞れるときは、埋め込みだけを binary で取ってきて
+    手元で cosine を計算し（simsimd があればそれ、無ければ NumPy）、上位 top_k の行だけを取り直す。
+    halfvec の列なら候補は float16 のまま受け取る。
+    候補は max_candidates 件で打ち切るので、絞り込みが弱いときは search を使う。
+    """
+    q = np.asarray(query_emb, dtype=np.float32).ravel()
+    params: Dict[str, Any] = {"n": max_candidates}
+    stmt = _compile_candidates(_bind_filters(filters, params))
+
+    _register_vector(conn)
+    with conn.cursor(binary=True) as cur:
         cur.execute(stmt, params)
-        rows = cur.fetchall()
+        cand_rows = cur.fetchall()
+    if not cand_rows or top_k <= 0:
+        return []
+
+    ids = np.fromiter((r[0] for r in cand_rows), dtype=np.int64, count=len(cand_rows))
+    cand = np.vstack([r[1] for r in cand_rows])
+    dist = _cosine_distances(q, cand)
+
+    k = min(int(top_k), len(ids))
+    top = np.argpartition(dist, k - 1)[:k]
+    top = top[np.argsort(dist[top], kind="stable")]
+    scores = 1.0 - dist[top]
+    if min_score is not None:
+        keep = scores >= float(min_score)
+        top, scores = top[keep], scores[keep]
+    if top.size == 0:
+        return []
+
+    top_ids = ids[top].tolist()
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, source, text, metadata FROM vector_docs WHERE id = ANY(%s)", (top_ids,))
+        by_id = {r[0]: r[1:] for r in cur.fetchall()}
 
     out: List[Dict[str, Any]] = []
-    for source, text, metadata, score in rows:
-        out.append(
-            {
-                "source": source,
-                "text": text,
-                "metadata": metadata,
-                "score": float(score),
-            }
-        )
+    for doc_id, score in zip(top_ids, scores.tolist()):
+        row = by_id.get(doc_id)
+        if row is None:
+            continue
+        source, text, metadata = row
+        out.append({"source": source, "text": text, "metadata": metadata, "score": float(score)})
     return out
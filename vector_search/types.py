@@ -4,7 +4,7 @@ from dataclasses import dataclass
 from typing import Any, Dict
 
 
-@dataclass
+@dataclass(slots=True)
 class VectorDoc:
     source: str
     text: str